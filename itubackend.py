@@ -5,7 +5,9 @@ Backend for ITU project - file manager
 
 import os
 from os.path import join
+import errno
 import subprocess
+import signal
 import ntpath
 from pathlib import Path
 import sys
@@ -13,8 +15,28 @@ import shlex
 import shutil
 import psutil
 from datetime import datetime
+from stat import S_ISDIR, S_IMODE
 from socket import gethostname
 import getpass
+import threading
+import collections
+import struct
+import itertools
+import ctypes
+import ctypes.util
+import sqlite3
+import hashlib
+import queue
+import time
+import concurrent.futures
+import json
+import re
+import fnmatch
+import functools
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 __author__ = ["Marek Sedláček (xsedla1b)", "Klára Ungrová (xungro00)", "Ronald Telmanik (xtelma00)"]
 __email__ = ["xsedla1b@fit.vutbr.cz", "xungro00@fit.vutbr.cz", "xtelma00@fit.vutbr.cz"]
@@ -34,14 +56,426 @@ def get_divisor(metric):
         return 1
 
 
+def auto_metric(size):
+    """
+    :param size: Size in bytes
+    :return: tuple (size, "metric") in the best metric for displaying
+    """
+    if size < 1000:
+        metric = "B"
+    elif size < 1000000:
+        metric = "KB"
+    elif size < 1000000000:
+        metric = "MB"
+    elif size < 1000000000000:
+        metric = "GB"
+    else:
+        metric = "TB"
+    return size / get_divisor(metric), metric
+
+
+# Background workers (copying, moving, removing and scanning) run at idle I/O priority and lowest CPU priority
+IDLE_PRIORITY = False
+_thread_priority = threading.local()
+
+
+def apply_background_priority():
+    """
+    Sets I/O and CPU priority of the calling worker thread according to IDLE_PRIORITY,
+    on Linux both are set per thread. Raising CPU priority back may need privileges.
+    """
+    idle = IDLE_PRIORITY
+    if getattr(_thread_priority, "idle", False) == idle:
+        return
+    _thread_priority.idle = idle
+    tid = threading.get_native_id()
+    try:
+        psutil.Process(tid).ionice(psutil.IOPRIO_CLASS_IDLE if idle else psutil.IOPRIO_CLASS_NONE)
+    except (AttributeError, OSError, psutil.Error):  # Not supported on this system
+        pass
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19 if idle else 0)
+    except (AttributeError, OSError):
+        pass
+
+
+class TokenBucket:
+    """
+    Limits rate of some operations, taking more than is available blocks
+    until the tokens are refilled
+    """
+
+    def __init__(self, rate=0):
+        """
+        :param rate: Tokens refilled per second (0 for no limit), at most one second worth is stored
+        """
+        self._lock = threading.Lock()
+        self.rate = rate
+        self._tokens = rate
+        self._time = time.monotonic()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+            self._tokens = min(self._tokens, rate)
+
+    def consume(self, amount, cancel=None):
+        """
+        Takes tokens, waits if there is not enough of them
+        :param amount: Amount of tokens, it can be more than the stored maximum
+        :param cancel: threading.Event stopping the waiting when set (optional)
+        """
+        with self._lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._time) * self.rate)
+            self._time = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            if cancel is not None:
+                cancel.wait(wait)
+            else:
+                time.sleep(wait)
+
+
+COPY_BUFFER = 1024 * 1024
+FICLONE = 0x40049409  # ioctl sharing all extents of a file (btrfs, XFS, ...)
+# Cloning is tried first, then copying in kernel, "read" (through userspace buffer) always works
+COPY_METHODS = ((["reflink"] if fcntl is not None and sys.platform.startswith("linux") else []) +
+                [m for m in ("copy_file_range", "sendfile") if hasattr(os, m)] + ["read"])
+COPY_FALLBACK_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.EBADF, errno.ENOTTY}
+# Files at least this big are copied in ranges by more threads at once
+LARGE_FILE_THRESHOLD = 256 * 1024 * 1024
+LARGE_FILE_WORKERS = 4
+LARGE_FILE_CHUNK = 32 * 1024 * 1024
+
+
+def clone_file(fsrc, fdst):
+    """
+    Makes destination share all data of the source file (reflink), the data are not copied
+    :param fsrc: File descriptor of the source file
+    :param fdst: File descriptor of the destination file (empty)
+    :return: If the filesystem supports cloning
+    """
+    if "reflink" not in COPY_METHODS:
+        return False
+    try:
+        fcntl.ioctl(fdst, FICLONE, fsrc)
+    except OSError as e:
+        if e.errno in COPY_FALLBACK_ERRORS:
+            return False
+        raise
+    return True
+
+
+def copy_data(fsrc, fdst, job=None, length=None):
+    """
+    Copies data from the current position of an opened file, in kernel if the filesystems allow it
+    Whole file is cloned instead if both files are at the start and the filesystem supports reflinks
+    :param fsrc: File descriptor of the source file
+    :param fdst: File descriptor of the destination file
+    :param job: TransferJob to which the progress is reported (optional)
+    :param length: Amount of bytes to be copied (None for the rest of the file)
+    :raise: OperationCancelledException if the job was cancelled
+    :return: Name of the method which copied the data
+    """
+    for method in COPY_METHODS:
+        if method == "reflink":
+            if length is None and os.lseek(fsrc, 0, os.SEEK_CUR) == 0 and os.lseek(fdst, 0, os.SEEK_CUR) == 0 \
+                    and clone_file(fsrc, fdst):
+                if job is not None:
+                    job.update(os.fstat(fsrc).st_size, io=False)
+                return method
+            continue
+        copied = 0
+        while length is None or copied < length:
+            count = COPY_BUFFER if length is None else min(COPY_BUFFER, length - copied)
+            try:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(fsrc, fdst, count)
+                elif method == "sendfile":
+                    n = os.sendfile(fdst, fsrc, None, count)
+                else:
+                    buf = memoryview(os.read(fsrc, count))
+                    n = len(buf)
+                    while buf:
+                        buf = buf[os.write(fdst, buf):]
+            except OSError as e:
+                if copied == 0 and e.errno in COPY_FALLBACK_ERRORS:
+                    break  # Not supported, try next method
+                raise
+            if n == 0:
+                # Some filesystems (e.g. procfs) report nothing to the kernel methods
+                if copied == 0 and method != "read":
+                    break
+                return method
+            copied += n
+            if job is not None:
+                job.update(n)
+        else:
+            return method
+    return "read"
+
+
+def data_regions(fd, size):
+    """
+    :param fd: File descriptor
+    :param size: Size of the file
+    :return: Generator of (offset, length) of the parts of the file containing data, holes are skipped
+    """
+    pos = 0
+    while pos < size:
+        try:
+            data = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            return  # Only a hole up to the end
+        hole = min(os.lseek(fd, data, os.SEEK_HOLE), size)
+        if hole > data:
+            yield data, hole - data
+        pos = hole
+
+
+def copy_sparse(fsrc, fdst, size, job=None):
+    """
+    Copies only the data regions of a sparse file, holes are left unallocated in the destination
+    :param fsrc: File descriptor of the source file
+    :param fdst: File descriptor of the destination file (empty)
+    :param size: Size of the source file
+    :param job: TransferJob to which the progress is reported (optional)
+    :raise: OperationCancelledException if the job was cancelled
+    :return: Name of the method which copied the data
+    """
+    if clone_file(fsrc, fdst):
+        if job is not None:
+            job.update(size, io=False)
+        return "reflink"
+    pos = 0
+    for offset, length in data_regions(fsrc, size):
+        if job is not None and offset > pos:
+            job.update(offset - pos, io=False)  # Skipped hole
+        os.lseek(fsrc, offset, os.SEEK_SET)
+        os.lseek(fdst, offset, os.SEEK_SET)
+        copy_data(fsrc, fdst, job, length)
+        pos = offset + length
+    if job is not None and size > pos:
+        job.update(size - pos, io=False)
+    os.ftruncate(fdst, size)
+    return "sparse"
+
+
+def run_parallel(function, args, workers):
+    """
+    Calls function for each of the arguments on up to workers threads
+    :return: List of results in the order of the arguments
+    """
+    if workers <= 1 or len(args) <= 1:
+        return [function(a) for a in args]
+    with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="range-copy",
+                                               initializer=apply_background_priority) as pool:
+        futures = [pool.submit(function, a) for a in args]
+        try:
+            return [f.result() for f in futures]
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+
+
+def copy_range(fsrc, fdst, offset, length, job=None, hasher=None):
+    """
+    Copies part of a file to the same offset in the destination with positional I/O,
+    the file positions are not used, so more ranges can be copied at once
+    :param fsrc: File descriptor of the source file
+    :param fdst: File descriptor of the destination file
+    :param offset: Where the range starts
+    :param length: Length of the range
+    :param job: TransferJob to which the progress is reported (optional)
+    :param hasher: hashlib object updated with the copied data, they are copied through userspace then
+    :raise: OperationCancelledException if the job was cancelled
+    :return: Name of the method which copied the data
+    """
+    end = offset + length
+    method = "copy_file_range" if hasattr(os, "copy_file_range") and hasher is None else "pread"
+    while offset < end:
+        count = min(COPY_BUFFER, end - offset)
+        if method == "copy_file_range":
+            try:
+                n = os.copy_file_range(fsrc, fdst, count, offset, offset)
+            except OSError as e:
+                if e.errno not in COPY_FALLBACK_ERRORS:
+                    raise
+                n = 0
+            if n == 0:  # Not supported or nothing reported, pread tells if it is the end of file
+                method = "pread"
+                continue
+        else:
+            buf = memoryview(os.pread(fsrc, count, offset))
+            n = len(buf)
+            if n == 0:
+                break
+            if hasher is not None:
+                hasher.update(buf)
+            written = 0
+            while written < n:
+                written += os.pwrite(fdst, buf[written:], offset + written)
+        offset += n
+        if job is not None:
+            job.update(n)
+    return method
+
+
+def copy_parallel(fsrc, fdst, size, job=None, workers=None, done=(), range_done=None):
+    """
+    Copies a large file in LARGE_FILE_CHUNK ranges by more threads at once
+    :param fsrc: File descriptor of the source file
+    :param fdst: File descriptor of the destination file (empty unless resuming)
+    :param size: Size of the source file
+    :param job: TransferJob to which the progress is reported (optional)
+    :param workers: Amount of threads (LARGE_FILE_WORKERS if None)
+    :param done: Set of (offset, length) of ranges copied before, they are skipped
+    :param range_done: Called with offset and length of each copied range (optional)
+    :raise: OperationCancelledException if the job was cancelled
+    :return: Name of the method which copied the data
+    """
+    if not done and clone_file(fsrc, fdst):
+        if job is not None:
+            job.update(size, io=False)
+        return "reflink"
+    os.ftruncate(fdst, size)
+
+    def copy(offset):
+        length = min(LARGE_FILE_CHUNK, size - offset)
+        if (offset, length) in done:
+            if job is not None:
+                job.update(length, io=False)
+            return "resumed"
+        method = copy_range(fsrc, fdst, offset, length, job)
+        if range_done is not None:
+            range_done(offset, length)
+        return method
+    methods = run_parallel(copy, range(0, size, LARGE_FILE_CHUNK), workers or LARGE_FILE_WORKERS)
+    return "parallel " + collections.Counter(methods).most_common(1)[0][0]
+
+
+def copy_hashed(fsrc, fdst, size, sparse=False, job=None, workers=1):
+    """
+    Copies a file through userspace and hashes each of its LARGE_FILE_CHUNK ranges on the way,
+    so the source is read only once
+    :param fsrc: File descriptor of the source file
+    :param fdst: File descriptor of the destination file (empty)
+    :param size: Size of the source file
+    :param sparse: If only the data regions are copied
+    :param job: TransferJob to which the progress is reported (optional)
+    :param workers: Amount of threads copying the ranges
+    :raise: OperationCancelledException if the job was cancelled
+    :return: List of (offset, length, digest) of the copied ranges
+    """
+    regions = data_regions(fsrc, size) if sparse else [(0, size)]
+    ranges = [(offset, min(LARGE_FILE_CHUNK, start + length - offset)) for start, length in regions
+              for offset in range(start, start + length, LARGE_FILE_CHUNK)]
+    if job is not None:
+        job.update(size - sum(length for _, length in ranges), io=False)  # Skipped holes
+    os.ftruncate(fdst, size)
+
+    def copy(r):
+        hasher = hashlib.blake2b()
+        copy_range(fsrc, fdst, r[0], r[1], job, hasher)
+        return r[0], r[1], hasher.digest()
+    return run_parallel(copy, ranges, workers)
+
+
+def verify_copy(path, ranges, workers=1):
+    """
+    Reads the copied file back and compares hashes of its ranges with the ones made while copying
+    The file has to be synced, its pages are dropped from cache first, so the data are read from the disk
+    :param path: Path of the copied file
+    :param ranges: List of (offset, length, digest) returned by copy_hashed
+    :param workers: Amount of threads reading the ranges
+    :raise: VerificationFailedException if some range differs
+    """
+    with open(path, "rb") as f:
+        fd = f.fileno()
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+        def check(r):
+            hasher = hashlib.blake2b()
+            offset, end = r[0], r[0] + r[1]
+            while offset < end:
+                buf = os.pread(fd, min(COPY_BUFFER, end - offset), offset)
+                if not buf:
+                    break
+                hasher.update(buf)
+                offset += len(buf)
+            return hasher.digest() == r[2]
+        bad = [r[0] for r, ok in zip(ranges, run_parallel(check, ranges, workers)) if not ok]
+    if bad:
+        raise VerificationFailedException("Copy {} differs from the source at offset {}".format(path, bad[0]))
+
+
+def copy_file(src, dst, job=None, workers=None, verify=False):
+    """
+    Copies contents and permission bits of a file, holes of sparse files are preserved
+    and files bigger than LARGE_FILE_THRESHOLD are copied by more threads
+    :param src: Path of the copied file
+    :param dst: Path of the new file
+    :param job: TransferJob to which the progress and the used method are reported (optional)
+    :param workers: Amount of threads copying a large file (LARGE_FILE_WORKERS if None)
+    :param verify: Data are hashed while copying and the copy is read back and checked (no reflinks are made)
+    :raise: OperationCancelledException if the job was cancelled
+    :raise: VerificationFailedException if the copy differs from the source
+    :raise: shutil.SameFileError if src and dst are the same file
+    :return: Path of the new file
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError("{} and {} are the same file".format(src, dst))
+    workers = workers or LARGE_FILE_WORKERS
+    journal = job.journal if job is not None else None
+    ranges = None
+    with open(src, "rb") as fsrc:
+        st = os.fstat(fsrc.fileno())
+        # Ranges of a large file copied before the transfer was interrupted, if the source did not change since
+        done = journal.get_ranges(dst, st) if journal is not None and not verify and os.path.exists(dst) else set()
+        with open(dst, "r+b" if done else "wb") as fdst:
+            # Less allocated blocks than the size means there are holes
+            sparse = hasattr(os, "SEEK_DATA") and st.st_blocks * 512 < st.st_size
+            large = st.st_size >= LARGE_FILE_THRESHOLD
+            if not large:
+                workers = 1
+            if verify:
+                ranges = copy_hashed(fsrc.fileno(), fdst.fileno(), st.st_size, sparse, job, workers)
+                os.fsync(fdst.fileno())
+                method = "verified"
+            elif sparse:
+                method = copy_sparse(fsrc.fileno(), fdst.fileno(), st.st_size, job)
+            elif large and (workers > 1 or journal is not None):
+                method = copy_parallel(fsrc.fileno(), fdst.fileno(), st.st_size, job, workers, done,
+                                       None if journal is None else lambda o, n: journal.range_done(dst, o, n, st))
+            else:
+                method = copy_data(fsrc.fileno(), fdst.fileno(), job)
+    if ranges is not None:
+        verify_copy(dst, ranges, workers)
+    if job is not None:
+        job.add_method(method)
+    shutil.copymode(src, dst)
+    return dst
+
+
 class Item:
 
-    def __init__(self, path):
+    def __init__(self, path, entry=None):
         """
         :param path: Absolute path to this item
+        :param entry: os.DirEntry from which this item was listed (optional)
         """
         self._path = path
-        self._name = ntpath.basename(path)
+        self._name = entry.name if entry is not None else ntpath.basename(path)
+        self._entry = entry
+        self._stat = None
 
     def is_file(self):
         """
@@ -73,15 +507,112 @@ class Item:
         """
         return Folder(str(Path(self._path).parent))
 
+    def get_stat(self):
+        """
+        Stat info is fetched only once and then reused by size, time and sorting
+        :return: os.stat_result of this item (symlinks are followed)
+        """
+        if self._stat is None:
+            self._stat = self._entry.stat() if self._entry is not None else os.stat(self._path)
+        return self._stat
+
+    def _duplicate(self):
+        """
+        :return: Copy of this item sharing the cached stat info, renaming or moving it does not change this one
+        """
+        item = object.__new__(type(self))
+        item.__dict__.update(self.__dict__)
+        return item
+
+    def _set_path(self, path):
+        """
+        Changes path of this item and drops cached stat info
+        :param path: New absolute path
+        """
+        self._path = path
+        self._name = ntpath.basename(path)
+        self._entry = None
+        self._stat = None
+
     def rename(self, new_name):
         """
         Renames file or folder
         :param new_name: New name
         :return: None
         """
-        os.rename(self.get_path(), join(self.get_parent().get_path(), new_name))
-        self._path = join(self.get_parent().get_path(), new_name)
-        self._name = ntpath.basename(self._path)
+        new_path = join(self.get_parent().get_path(), new_name)
+        os.rename(self.get_path(), new_path)
+        self._set_path(new_path)
+
+    def get_destination(self, to, rename_duplicit=False, reserved=()):
+        """
+        :param to: folder to which the item would be copied or moved (object or address)
+        :param rename_duplicit: appends number to the name if there already is an item
+                                with the same name
+        :param reserved: Paths which are taken even if nothing exists there yet (e.g. by running transfers)
+        :return: Path of the copied or moved item
+        :raise: FileExistsError if an item of other type (file or folder) has the same name and
+                rename_duplicit is false, it would not be replaced
+        """
+        top = to.get_path() if type(to) == Folder else to
+        new_path = join(top, self.get_name())
+        if rename_duplicit and (os.path.lexists(new_path) or new_path in reserved):
+            i = 2
+            # Create unique name, any existing item is a conflict (a file is never copied into a folder)
+            while os.path.lexists(join(top, self.get_name() + "(" + str(i) + ")")) or \
+                    join(top, self.get_name() + "(" + str(i) + ")") in reserved:
+                i += 1
+            new_path = join(top, self.get_name()) + "(" + str(i) + ")"
+        elif os.path.lexists(new_path) and os.path.isdir(new_path) != self.is_folder():
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), new_path)
+        return new_path
+
+    def move(self, to, rename_duplicit=False, job=None, verify=False):
+        """
+        Moves item to another folder
+        Within one filesystem the item is only renamed, otherwise it is copied and removed
+        :param to: folder to which to move (object or address)
+        :param rename_duplicit: renames moved item by appending number to it if
+                                there already is an item with the same name
+        :param job: TransferJob to which the progress is reported (optional)
+        :param verify: Copied data are checked against the source (see copy_file),
+                       the source is not removed if they differ
+        :raise: VerificationFailedException if the copy differs from the source
+        """
+        self._move_to(self.get_destination(to, rename_duplicit), job, verify)
+
+    def _move_to(self, new_path, job=None, verify=False):
+        """
+        :param new_path: New path of this item
+        :param job: TransferJob to which the progress of copying is reported (optional)
+        :param verify: Copied data are checked against the source before the source is removed
+        """
+        if os.lstat(self.get_path()).st_dev == os.stat(os.path.dirname(new_path)).st_dev:
+            # Replace existing folder the same way as copy does
+            if self.is_folder() and os.path.isdir(new_path) and not os.path.samefile(self.get_path(), new_path):
+                Folder(new_path).remove()
+            try:
+                os.rename(self.get_path(), new_path)
+                self._set_path(new_path)
+                if job is not None:
+                    job.add_method("rename")
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:  # Bind mounts share st_dev but can't be renamed across
+                    raise
+        self._copy_to(new_path, job, verify)
+        if job is not None:
+            job.copy_finished()
+        self.remove()
+        self._set_path(new_path)
+
+    def trash(self):
+        """
+        Moves item to the trash folder of its device, it can be restored until the trash is purged
+        :raise: OSError if the device has no usable trash folder
+        :return: TrashItem object
+        """
+        return FileManager.trash.put(self)
 
     def __str__(self):
         return self._path
@@ -97,7 +628,26 @@ class Folder(Item):
         """
         :return: list of Files and Folders (objects)
         """
-        return [Folder(join(self._path, f)) if os.path.isdir(join(self._path, f)) else File(join(self._path, f)) for f in os.listdir(self._path)]
+        return [i for batch in self.iter_content() for i in batch]
+
+    def iter_content(self, batch_size=1000):
+        """
+        Lists folder using os.scandir, so the item type comes from the directory
+        entry and stat info is cached on the returned items
+        Items are yielded in batches as they are read, so the caller does not
+        have to wait for the whole folder to be listed
+        :param batch_size: Maximum amount of items in one batch
+        :return: generator of lists of Files and Folders (objects)
+        """
+        batch = []
+        with os.scandir(self._path) as it:
+            for e in it:
+                batch.append(Folder(e.path, e) if e.is_dir() else File(e.path, e))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
 
     def create_folder(self, name):
         """
@@ -129,71 +679,75 @@ class Folder(Item):
         """
         return not os.path.isdir(to.get_path() if type(to) == Folder else to)
 
-    def copy(self, to, rename_duplicit=False):
+    def copy(self, to, rename_duplicit=False, job=None, verify=False):
         """
         Copies this file to passed in folder
         :param to: folder to which to copy (object or address)
+        :param job: TransferJob to which the progress is reported (optional)
+        :param verify: Copied files are checked against the source (see copy_file)
+        :raise: shutil.Error if some files could not be copied or differ from the source
         :return: Folder object of the copied file
         """
-        new_path = join(to.get_path(), self.get_name()) if type(to) == Folder else join(to, self.get_name())
-        top = to.get_path() if type(to) == Folder else to
-        if rename_duplicit and not self.can_be_copied(join(top, self.get_name())):
-            i = 2
-            # Create unique name
-            while not self.can_be_copied(join(top, self.get_name() + "(" + str(i) + ")")):
-                i += 1
-            new_path = join(top, self.get_name()) + "(" + str(i) + ")"
+        return self._copy_to(self.get_destination(to, rename_duplicit), job, verify)
 
-        # Remove folder if one with the same name exists
-        if os.path.isdir(new_path):
-            Folder(new_path).remove()
-        shutil.copytree(self.get_path(), new_path)
-        return Folder(new_path)
-
-    def move(self, to, rename_duplicit=False):
+    def _copy_to(self, new_path, job=None, verify=False):
         """
-        Moves folder to another
-        :param to: folder to which to move (object or address)
-        :param rename_duplicit: renames copied file by appending number to it if
-                                there already is a file with the same name
+        :param new_path: Path of the copy
+        :param job: TransferJob to which the progress is reported (optional)
+        :param verify: Copied files are checked against the source
+        :return: Folder object of the copy
         """
-        new_dest = self.copy(to, rename_duplicit)
-        self.remove()
-        self._path = new_dest.get_path()
-        self._name = new_dest.get_name()
+        if job is not None:
+            job.set_total(self.walk(cancel=job.cancelled).size)
+        # Remove folder if one with the same name exists, unless it is an interrupted copy
+        if os.path.isdir(new_path) and not (job is not None and job.is_resumed()):
+            Folder(new_path).remove()
+        TreeCopier(job, verify).copy(self.get_path(), new_path)
+        return Folder(new_path)
 
-    def remove(self):
+    def remove(self, job=None):
         """
-        Removes this folder and all files and folder inside of it
+        Removes this folder and all files and folder inside of it (permanently, see trash)
+        :param job: TransferJob to which the amount of removed items is reported (optional)
+        :raise: shutil.Error with list of (path, reason) if some items could not be removed
         :return: Folder object of parent folder
         """
         retv = self.get_parent()
-        shutil.rmtree(self.get_path())
+        if os.path.islink(self.get_path()):  # Only the link is removed, never the tree it points to
+            if job is not None:
+                job.set_total(1)
+            os.unlink(self.get_path())
+            if job is not None:
+                job.update(1)
+            return retv
+        if job is not None:
+            job.set_total(self.walk(cancel=job.cancelled).get_item_count() + 1)
+        TreeRemover(job).remove(self.get_path())
         return retv
 
     def get_size(self, metric="B"):
         """
-        Taken from: https://stackoverflow.com/a/1392549
         :param metric: return value metric
         :return: Folder size as float
         """
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(self.get_path()):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                # skip if it is symbolic link
-                if not os.path.islink(fp):
-                    total_size += os.path.getsize(fp)
-        return total_size / get_divisor(metric)
+        return self.walk().size / get_divisor(metric)
 
     def get_item_count(self):
         """
         :return: How many items are in this folder
         """
-        amount = 0
-        for dirpath, dirnames, filenames in os.walk(self.get_path()):
-            amount += len(filenames) + len(dirnames)
-        return amount
+        return self.walk().get_item_count()
+
+    def walk(self, max_depth=None, cancel=None, one_filesystem=False):
+        """
+        Measures the whole tree of this folder in a single parallel pass
+        :param max_depth: How many levels of subfolders are walked (None for all)
+        :param cancel: threading.Event which stops the walk when set
+        :param one_filesystem: Mounted filesystems inside of this folder are not walked
+        :return: TreeWalker with size, file and folder counts and the newest modification time
+        :raise: OperationCancelledException if the walk was cancelled
+        """
+        return TreeWalker(max_depth, cancel, one_filesystem).walk(self.get_path())
 
     def is_folder(self):
         return True
@@ -202,6 +756,334 @@ class Folder(Item):
         return self.get_content().__iter__()
 
 
+class TreeWalker:
+    """
+    Walks folder tree with os.scandir, subfolders are fanned out across a shared
+    thread pool and size, file count, folder count and the newest modification
+    time are gathered in a single pass. Symbolic links are counted, but not
+    followed and their size is not included (the same as os.walk).
+    Unreadable folders are skipped, with one_filesystem mount points are counted,
+    but not entered (the same as du -x).
+    """
+
+    WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, max_depth=None, cancel=None, one_filesystem=False):
+        """
+        :param max_depth: How many levels of subfolders are walked (None for all)
+        :param cancel: threading.Event which stops the walk when set
+        :param one_filesystem: Subfolders on other filesystems than the walked folder are not walked
+        """
+        self.max_depth = max_depth
+        self.cancel = cancel if cancel is not None else threading.Event()
+        self.one_filesystem = one_filesystem
+        self._dev = None
+        self.size = 0
+        self.files = 0
+        self.dirs = 0
+        self.mtime = 0
+
+    def get_item_count(self):
+        return self.files + self.dirs
+
+    def walk(self, path):
+        """
+        :param path: Path of the folder to walk
+        :return: self
+        :raise: OperationCancelledException if the walk was cancelled
+        """
+        if self.one_filesystem:
+            try:
+                self._dev = os.stat(path).st_dev
+            except OSError:  # Unreadable, the walk finds nothing
+                pass
+        pool = TreeWalker._get_pool()
+        results = queue.Queue()
+        pool.submit(self._scan, path, 0, results)
+        outstanding = 1
+        while outstanding > 0:
+            if self.cancel.is_set():
+                raise OperationCancelledException("Walk of {} was cancelled".format(path))
+            try:
+                size, files, dirs, mtime, subdirs, depth = results.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            outstanding -= 1
+            self.size += size
+            self.files += files
+            self.dirs += dirs
+            self.mtime = max(self.mtime, mtime)
+            if self.max_depth is None or depth < self.max_depth:
+                for d in subdirs:
+                    pool.submit(self._scan, d, depth + 1, results)
+                outstanding += len(subdirs)
+        return self
+
+    def _scan(self, path, depth, results):
+        size, files, dirs, mtime, subdirs = 0, 0, 0, 0, []
+        try:
+            apply_background_priority()
+            if self.cancel.is_set():
+                return
+            with os.scandir(path) as it:
+                for e in it:
+                    try:
+                        if e.is_dir():
+                            dirs += 1
+                            if not e.is_symlink():
+                                st = e.stat(follow_symlinks=False)
+                                mtime = max(mtime, st.st_mtime)
+                                if self._dev is None or st.st_dev == self._dev:
+                                    subdirs.append(e.path)
+                        else:
+                            files += 1
+                            if not e.is_symlink():
+                                st = e.stat(follow_symlinks=False)
+                                size += st.st_size
+                                mtime = max(mtime, st.st_mtime)
+                    except OSError:  # Removed while walking
+                        pass
+        except OSError:
+            pass
+        finally:  # Result is always sent, so the walk does not wait forever
+            results.put((size, files, dirs, mtime, subdirs, depth))
+
+    @staticmethod
+    def _get_pool():
+        with TreeWalker._pool_lock:
+            if TreeWalker._pool is None:
+                TreeWalker._pool = concurrent.futures.ThreadPoolExecutor(TreeWalker.WORKERS,
+                                                                         thread_name_prefix="tree-walker")
+            return TreeWalker._pool
+
+
+class TreeCopier:
+    """
+    Copies folder tree across a shared thread pool. Folders are listed and
+    created by one kind of tasks, their files are copied in batches by another,
+    so metadata and data work of different folders overlap. Contents are copied
+    in kernel where possible (see copy_data), modes and times are preserved.
+    Symbolic links are followed (the same as shutil.copytree).
+    """
+
+    WORKERS = min(32, (os.cpu_count() or 1) * 4)
+    BATCH_FILES = 64
+    BATCH_BYTES = 16 * 1024 * 1024
+
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, job=None, verify=False):
+        """
+        :param job: TransferJob to which the progress is reported (optional)
+        :param verify: Copied files are checked against the source (see copy_file)
+        """
+        self.job = job
+        self.verify = verify
+        self.journal = job.journal if job is not None else None
+        self.cancel = job.cancelled if job is not None else threading.Event()
+        self.errors = []
+
+    def copy(self, src, dst):
+        """
+        :param src: Path of the copied folder
+        :param dst: Path of the new folder, it must not exist
+        :raise: shutil.Error with list of (source, destination, reason) if some items could not be copied
+        :raise: OperationCancelledException if the job was cancelled
+        :return: self
+        """
+        self._mkdir(dst)
+        pool = TreeCopier._get_pool()
+        results = queue.Queue()
+        folders = [(src, dst)]
+        pool.submit(self._list, src, dst, results)
+        outstanding = 1
+        while outstanding > 0:
+            subdirs, files = results.get()
+            outstanding -= 1
+            if self.cancel.is_set():
+                continue  # Let running tasks finish before the tree is removed
+            folders.extend(subdirs)
+            for d in subdirs:
+                pool.submit(self._list, d[0], d[1], results)
+            outstanding += len(subdirs)
+            batch, batch_size = [], 0
+            for f in files:
+                batch.append(f)
+                batch_size += f[2].st_size
+                if len(batch) >= TreeCopier.BATCH_FILES or batch_size >= TreeCopier.BATCH_BYTES:
+                    pool.submit(self._copy_files, batch, results)
+                    outstanding += 1
+                    batch, batch_size = [], 0
+            if batch:
+                pool.submit(self._copy_files, batch, results)
+                outstanding += 1
+        if self.cancel.is_set():
+            raise OperationCancelledException("Copy of {} was cancelled".format(src))
+        # Folders get their times after all their content was written
+        for s, d in reversed(folders):
+            try:
+                shutil.copystat(s, d)
+            except OSError as e:
+                self.errors.append((s, d, str(e)))
+        if self.errors:
+            raise shutil.Error(self.errors)
+        return self
+
+    def _list(self, src, dst, results):
+        subdirs, files = [], []
+        try:
+            apply_background_priority()
+            if self.cancel.is_set():
+                return
+            with os.scandir(src) as it:
+                for e in it:
+                    target = join(dst, e.name)
+                    try:
+                        if e.is_dir():
+                            self._mkdir(target)
+                            subdirs.append((e.path, target))
+                        else:
+                            files.append((e.path, target, e.stat()))
+                    except OSError as err:
+                        self.errors.append((e.path, target, str(err)))
+        except OSError as err:
+            self.errors.append((src, dst, str(err)))
+        finally:  # Result is always sent, so the copy does not wait forever
+            results.put((subdirs, files))
+
+    def _copy_files(self, files, results):
+        try:
+            apply_background_priority()
+            for src, dst, st in files:
+                if self.cancel.is_set():
+                    return
+                if self.journal is not None and self.journal.is_done(dst, st):
+                    self.job.update(st.st_size, io=False)
+                    continue
+                try:
+                    copy_file(src, dst, self.job, verify=self.verify)
+                    shutil.copystat(src, dst)
+                    if self.journal is not None:
+                        self.journal.file_done(dst, st)
+                except (OSError, VerificationFailedException) as err:
+                    self.errors.append((src, dst, str(err)))
+        except OperationCancelledException:
+            pass
+        finally:
+            results.put(([], []))
+
+    def _mkdir(self, path):
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            # Folders of an interrupted copy are reused
+            if self.journal is None or not self.journal.resumed or not os.path.isdir(path):
+                raise
+
+    @staticmethod
+    def _get_pool():
+        with TreeCopier._pool_lock:
+            if TreeCopier._pool is None:
+                TreeCopier._pool = concurrent.futures.ThreadPoolExecutor(TreeCopier.WORKERS,
+                                                                         thread_name_prefix="tree-copier")
+            return TreeCopier._pool
+
+
+class TreeRemover:
+    """
+    Removes folder tree across a shared thread pool. Files of different folders
+    are unlinked at once, folders are removed deepest first once they are empty.
+    Symbolic links are removed, not followed.
+    """
+
+    WORKERS = min(16, (os.cpu_count() or 1) * 2)
+
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, job=None):
+        """
+        :param job: TransferJob to which the amount of removed items is reported (optional)
+        """
+        self.job = job
+        self.cancel = job.cancelled if job is not None else threading.Event()
+        self.errors = []
+
+    def remove(self, path):
+        """
+        :param path: Path of the removed folder
+        :raise: shutil.Error with list of (path, reason) if some items could not be removed
+        :raise: OperationCancelledException if the job was cancelled
+        """
+        if os.path.islink(path):
+            os.unlink(path)
+            if self.job is not None:
+                self.job.update(1)
+            return
+        pool = TreeRemover._get_pool()
+        results = queue.Queue()
+        folders = [path]
+        pool.submit(self._clear, path, results)
+        outstanding = 1
+        while outstanding > 0:
+            subdirs = results.get()
+            outstanding -= 1
+            if self.cancel.is_set():
+                continue  # Let running tasks finish
+            folders.extend(subdirs)
+            for d in subdirs:
+                pool.submit(self._clear, d, results)
+            outstanding += len(subdirs)
+        if self.cancel.is_set():
+            raise OperationCancelledException("Removal of {} was cancelled".format(path))
+        for d in reversed(folders):
+            try:
+                os.rmdir(d)
+            except OSError as e:
+                self.errors.append((d, str(e)))
+        if self.job is not None:
+            self.job.update(len(folders))
+        if self.errors:
+            raise shutil.Error(self.errors)
+
+    def _clear(self, path, results):
+        subdirs, removed = [], 0
+        try:
+            apply_background_priority()
+            if self.cancel.is_set():
+                return
+            with os.scandir(path) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            subdirs.append(e.path)
+                        else:
+                            os.unlink(e.path)
+                            removed += 1
+                    except OSError as err:
+                        self.errors.append((e.path, str(err)))
+            if self.job is not None and removed > 0:
+                self.job.update(removed)
+        except OSError as err:
+            self.errors.append((path, str(err)))
+        except OperationCancelledException:
+            pass
+        finally:  # Result is always sent, so the removal does not wait forever
+            results.put(subdirs)
+
+    @staticmethod
+    def _get_pool():
+        with TreeRemover._pool_lock:
+            if TreeRemover._pool is None:
+                TreeRemover._pool = concurrent.futures.ThreadPoolExecutor(TreeRemover.WORKERS,
+                                                                          thread_name_prefix="tree-remover")
+            return TreeRemover._pool
+
+
 class File(Item):
     """
     File object - represents OS file (possibly symlink)
@@ -222,13 +1104,18 @@ class File(Item):
         else:
             os.system("start "+shlex.quote(self.get_path()))
 
-    def remove(self):
+    def remove(self, job=None):
         """
-        Deletes file
+        Deletes file (permanently, see trash)
+        :param job: TransferJob to which the removal is reported (optional)
         :return: Parent folder
         """
         retv = self.get_parent()
+        if job is not None:
+            job.set_total(1)
         os.remove(self.get_path())
+        if job is not None:
+            job.update(1)
         return retv
 
     def can_be_copied(self, to):
@@ -238,37 +1125,29 @@ class File(Item):
         """
         return not os.path.isfile(to.get_path() if type(to) == Folder else to)
 
-    def copy(self, to, rename_duplicit=False):
+    def copy(self, to, rename_duplicit=False, job=None, verify=False):
         """
         Copies this file to passed in folder
         :param to: folder to which to copy (object or address)
         :param rename_duplicit: renames copied file by appending number to it if
                                 there already is a file with the same name
+        :param job: TransferJob to which the progress is reported (optional)
+        :param verify: Copied data are checked against the source (see copy_file)
+        :raise: VerificationFailedException if the copy differs from the source
         """
-        top = to.get_path() if type(to) == Folder else to
-        if rename_duplicit and not self.can_be_copied(join(top, self.get_name())):
-            i = 2
-            # Create unique name
-            while not self.can_be_copied(join(top, self.get_name() + "(" + str(i) + ")")):
-                i += 1
-            new_path = self.get_name() + "(" + str(i) + ")"
-            shutil.copy(self.get_path(), join(to.get_path(), new_path) if type(to) == Folder else join(to, new_path))
-            return File(join(top, new_path))
-        else:
-            shutil.copy(self.get_path(), to.get_path() if type(to) == Folder else to)
-            return File(join(top, self.get_name()))
+        return self._copy_to(self.get_destination(to, rename_duplicit), job, verify)
 
-    def move(self, to, rename_duplicit=False):
+    def _copy_to(self, new_path, job=None, verify=False):
         """
-        Moves folder to another
-        :param to: folder to which to move (object or address)
-        :param rename_duplicit: renames copied file by appending number to it if
-                                there already is a file with the same name
+        :param new_path: Path of the copy
+        :param job: TransferJob to which the progress is reported (optional)
+        :param verify: Copied data are checked against the source
+        :return: File object of the copy
         """
-        new_dest = self.copy(to, rename_duplicit)
-        self.remove()
-        self._path = new_dest.get_path()
-        self._name = new_dest.get_name()
+        if job is not None:
+            job.set_total(self.get_stat().st_size)
+        copy_file(self.get_path(), new_path, job, verify=verify)
+        return File(new_path)
 
     def get_size(self, metric="B", metric_auto=False):
         """
@@ -276,24 +1155,14 @@ class File(Item):
         :param metric_auto: Automaticky finds the best metric
         :return: size or (size, "metric") if metric_auto is true
         """
-        s = os.path.getsize(self.get_path())
+        s = self.get_stat().st_size
         if metric_auto:
-            if s < 1000:
-                metric = "B"
-            elif s < 1000000:
-                metric = "KB"
-            elif s < 1000000000:
-                metric = "MB"
-            elif s < 1000000000000:
-                metric = "GB"
-            else:
-                metric = "TB"
-            return s / get_divisor(metric), metric
+            return auto_metric(s)
         else:
             return s / get_divisor(metric)
 
     def get_modification_time(self):
-        return os.path.getmtime(self.get_path())
+        return self.get_stat().st_mtime
 
 
 class Disk:
@@ -311,6 +1180,14 @@ class Disk:
     def get_path(self):
         return self._path
 
+    def get_usage(self):
+        """
+        Measures the disk now, may block on a hung mount, FileManager.disk_usage measures in background
+        :return: DiskUsage
+        :raise: OSError if the disk cannot be measured
+        """
+        return DiskUsage.measure(self._path)
+
     def get_free_space(self, metric="B"):
         """
         Returns free space on the disk
@@ -318,7 +1195,7 @@ class Disk:
                        B (Bytes) || KB (KibiBytes) || MB (MibiBytes) || GB (GibiBytes) || TB (TebiBytes)
         :return: disk capacity (float)
         """
-        return shutil.disk_usage(self._path).free / get_divisor(metric)
+        return self.get_usage().get_free_space(metric)
 
     def get_capacity(self, metric="B"):
         """
@@ -327,7 +1204,13 @@ class Disk:
                        B (Bytes) || KB (KibiBytes) || MB (MibiBytes) || GB (GibiBytes) || TB (TebiBytes)
         :return: disk capacity (float)
         """
-        return shutil.disk_usage(self._path).total / get_divisor(metric)
+        return self.get_usage().get_capacity(metric)
+
+    def get_index(self):
+        """
+        :return: FilenameIndex of this disk
+        """
+        return FilenameIndex.get(self._path)
 
     def get_used_space(self, metric="B"):
         """
@@ -336,11 +1219,1823 @@ class Disk:
                        B (Bytes) || KB (KibiBytes) || MB (MibiBytes) || GB (GibiBytes) || TB (TebiBytes)
         :return: disk capacity (float)
         """
-        return shutil.disk_usage(self._path).used / get_divisor(metric)
+        return self.get_usage().get_used_space(metric)
+
+
+class DiskUsage:
+    """
+    Capacity, used and free space of a disk taken by one statvfs call
+    """
+
+    def __init__(self, total, used, free):
+        self.total = total
+        self.used = used
+        self.free = free
+        self.time = time.time()
+
+    @staticmethod
+    def measure(path):
+        """
+        :param path: Path on the disk
+        :return: DiskUsage of the disk
+        :raise: OSError if the disk cannot be measured
+        """
+        if not hasattr(os, "statvfs"):  # Windows
+            usage = shutil.disk_usage(path)
+            return DiskUsage(usage.total, usage.used, usage.free)
+        st = os.statvfs(path)
+        # Same as shutil.disk_usage, free is the space available to unprivileged users
+        return DiskUsage(st.f_blocks * st.f_frsize, (st.f_blocks - st.f_bfree) * st.f_frsize, st.f_bavail * st.f_frsize)
+
+    def get_free_space(self, metric="B"):
+        return self.free / get_divisor(metric)
+
+    def get_capacity(self, metric="B"):
+        return self.total / get_divisor(metric)
+
+    def get_used_space(self, metric="B"):
+        return self.used / get_divisor(metric)
+
+
+class _MountUsage:
+    """
+    Latest measurement of one mount
+    """
+
+    def __init__(self):
+        self.usage = None
+        self.failed = False
+        self.measured = None  # time.monotonic of the last finished measurement
+        self.started = None  # time.monotonic of the running measurement
+        self.requested = time.monotonic()
+
+
+class DiskUsageMonitor:
+    """
+    Refreshes usage of requested disks in background every INTERVAL seconds
+    Every statvfs call runs in its own thread, so a hung mount (e.g. unreachable NFS) blocks
+    only its own measurement and is reported as unavailable once it takes longer than TIMEOUT
+    Mounts not requested for a while are not measured anymore
+    """
+
+    INTERVAL = 10  # seconds
+    TIMEOUT = 3  # seconds
+    FORGET_AFTER = 60  # seconds
+
+    def __init__(self, interval=INTERVAL, timeout=TIMEOUT):
+        self.interval = interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._mounts = {}  # mount point -> _MountUsage
+        self._thread = None
+
+    def get(self, path):
+        """
+        Never blocks, the mount is measured in background if it was not yet
+        :param path: Mount point
+        :return: Latest DiskUsage or None if it was not measured yet or the disk is unavailable
+        """
+        with self._lock:
+            mount = self._request(path)
+            return mount.usage if self._is_available(mount) else None
+
+    def is_available(self, path):
+        """
+        :return: False if the last measurement failed or takes longer than timeout
+        """
+        with self._lock:
+            return self._is_available(self._request(path))
+
+    def _request(self, path):
+        mount = self._mounts.get(path)
+        if mount is None:
+            mount = self._mounts[path] = _MountUsage()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="disk-usage", daemon=True)
+                self._thread.start()
+            self._wakeup.set()
+        mount.requested = time.monotonic()
+        return mount
+
+    def _is_available(self, mount):
+        if mount.started is not None and time.monotonic() - mount.started > self.timeout:
+            return False
+        return not mount.failed
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                for path, mount in list(self._mounts.items()):
+                    if mount.started is not None:
+                        continue  # At most one (possibly hung) measurement per mount
+                    if now - mount.requested > DiskUsageMonitor.FORGET_AFTER:
+                        del self._mounts[path]
+                    elif mount.measured is None or now - mount.measured >= self.interval:
+                        mount.started = now
+                        threading.Thread(target=self._measure, args=(path, mount), name="disk-usage-mount",
+                                         daemon=True).start()
+            self._wakeup.wait(1)
+            self._wakeup.clear()
+
+    def _measure(self, path, mount):
+        try:
+            usage = DiskUsage.measure(path)
+        except OSError:
+            usage = None
+        with self._lock:
+            mount.usage = usage
+            mount.failed = usage is None
+            mount.measured = time.monotonic()
+            mount.started = None
+
+
+class DiskRegistry:
+    """
+    Mounted disks are enumerated once and cached, the list is enumerated again only once
+    the mount table changes, which the kernel signals by POLLPRI on /proc/self/mountinfo
+    Polling rearms the signal, so fileno is watched by one owner only, which calls refresh,
+    other threads get the cached lists. Where it cannot be watched the list is enumerated
+    again after REFRESH_INTERVAL
+    """
+
+    MOUNTINFO = "/proc/self/mountinfo"
+    REFRESH_INTERVAL = 5  # seconds
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._disks = None
+        self._mounts = None
+        self._version = 0
+        self._listed = 0
+        self._mountinfo = None
+        try:
+            self._mountinfo = open(DiskRegistry.MOUNTINFO, "rb")
+        except OSError:  # Not Linux
+            pass
+
+    def fileno(self):
+        """
+        :return: File descriptor signalling mount changes by POLLPRI (exceptional condition) or None
+        """
+        return self._mountinfo.fileno() if self._mountinfo is not None else None
+
+    def get_version(self):
+        """
+        :return: Number which changes whenever the list of disks changes
+        """
+        return self._version
+
+    def get_disks(self):
+        """
+        :return: List of mounted disks (Disk objects), the same objects are returned until mounts change
+        """
+        with self._lock:
+            if self._disks is None or self._is_stale():
+                self._enumerate()
+            return list(self._disks)
+
+    def get_mounts(self):
+        """
+        :return: List of (mount point, filesystem type) of all mounts including virtual and network ones,
+                 cached in the same way as disks
+        """
+        with self._lock:
+            if self._disks is None or self._is_stale():
+                self._enumerate()
+            return self._mounts
+
+    def refresh(self):
+        """
+        Enumerates disks again, should be called by the owner watching fileno once it signals a change
+        :return: True if the list of disks changed
+        """
+        with self._lock:
+            version = self._version
+            self._enumerate()
+            return version != self._version
+
+    def _is_stale(self):
+        # Watched mount table is enumerated again by refresh only
+        return self._mountinfo is None and time.monotonic() - self._listed > DiskRegistry.REFRESH_INTERVAL
+
+    def _enumerate(self):
+        partitions = psutil.disk_partitions()
+        self._mounts = [(p.mountpoint, p.fstype) for p in psutil.disk_partitions(all=True)]
+        self._listed = time.monotonic()
+        key = [(p.device, p.mountpoint) for p in partitions]
+        if self._disks is not None and key == [(d.get_name(), d.get_path()) for d in self._disks]:
+            return
+        # Disks which stay mounted keep their objects
+        old = {(d.get_name(), d.get_path()): d for d in self._disks or []}
+        self._disks = [old.get(k) or Disk(p) for k, p in zip(key, partitions)]
+        self._version += 1
+
+
+def stat_item(path):
+    """
+    :param path: Absolute path to a file or folder
+    :return: Folder or File object with cached stat info or None if there is no such item
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        if not os.path.lexists(path):
+            return None
+        return File(path)  # Broken symbolic link
+    item = Folder(path) if S_ISDIR(st.st_mode) else File(path)
+    item._stat = st
+    return item
+
+
+def diff_listing(old, new):
+    """
+    Computes what changed between two listings of the same folder
+    Stat info is compared only for old items which have it cached,
+    other items cannot be displayed with outdated info
+    :param old: dict name -> Item of the previous listing
+    :param new: list of Items of the new listing
+    :return: dict name -> Item for added and changed items and name -> None for removed ones
+    """
+    updates = {}
+    for i in new:
+        o = old.get(i.get_name())
+        if o is None or o.is_folder() != i.is_folder():
+            updates[i.get_name()] = i
+        elif o._stat is not None:
+            try:
+                st = i.get_stat()
+                changed = (st.st_ino, st.st_size, st.st_mtime_ns, st.st_mode) != \
+                          (o._stat.st_ino, o._stat.st_size, o._stat.st_mtime_ns, o._stat.st_mode)
+            except OSError:
+                changed = True
+            if changed:
+                updates[i.get_name()] = i
+    names = set(i.get_name() for i in new)
+    for name in old:
+        if name not in names:
+            updates[name] = None
+    return updates
+
+
+class Inotify:
+    """
+    Minimal ctypes binding of Linux inotify
+    :raise: OSError if inotify is not available
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is available only on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask):
+        """
+        :return: Watch descriptor
+        :raise: OSError if the path cannot be watched
+        """
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read_events(self):
+        """
+        Reads all queued events without blocking
+        :return: list of (watch descriptor, mask, name) tuples
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = Inotify.EVENT.unpack_from(data, pos)
+                pos += Inotify.EVENT.size
+                events.append((wd, mask, os.fsdecode(data[pos:pos + length].rstrip(b"\0"))))
+                pos += length
+
+
+class _Snapshot:
+    """
+    Cached listing of one folder
+    """
+
+    ids = itertools.count()
+
+    def __init__(self, path, mtime, wd):
+        self.id = next(_Snapshot.ids)
+        self.path = path
+        self.mtime = mtime
+        self.wd = wd
+        self.items = None  # name -> Item, None while the folder is being listed
+        self.pending = set()  # Names reported by inotify which have to be stat-ed again
+        self.version = 0
+        self.changes = collections.OrderedDict()  # name -> version in which it last changed, oldest first
+        self.oldest = 0  # Changes since older versions were dropped from the log
+
+    def get_version(self):
+        return self.id, self.version
+
+
+class DirectoryCache:
+    """
+    Process-wide cache of folder listings shared by all FileManager objects
+    Callers get copies of the cached items, so renaming an item in one panel does not
+    change the cache or items shown in other panels. Watched folders are kept up to
+    date from inotify events, so only the changed entries are stat-ed again. Folders
+    which cannot be watched (network filesystems or inotify not available) are
+    relisted when their modification time changes.
+    """
+
+    MAX_FOLDERS = 64
+    MAX_CHANGES = 1024  # Changed names remembered per folder, older readers have to list it again
+    POLLED_FS = ("nfs", "nfs4", "cifs", "smbfs", "smb3", "9p", "fuse.sshfs")
+    WATCH_MASK = (Inotify.IN_CREATE | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO |
+                  Inotify.IN_MODIFY | Inotify.IN_ATTRIB | Inotify.IN_CLOSE_WRITE |
+                  Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF | Inotify.IN_ONLYDIR)
+
+    def __init__(self, max_folders=MAX_FOLDERS):
+        self._max_folders = max_folders
+        self._lock = threading.RLock()
+        self._snapshots = collections.OrderedDict()
+        self._watches = {}
+        self._changed = set()
+        try:
+            self._inotify = Inotify()
+        except (OSError, AttributeError):
+            self._inotify = None
+
+    def fileno(self):
+        """
+        :return: inotify file descriptor which becomes readable on changes or None
+        """
+        return self._inotify.fileno() if self._inotify is not None else None
+
+    def iter_content(self, folder, batch_size=1000):
+        """
+        Same as Folder.iter_content, but the listing is taken from cache when possible
+        :param folder: Folder to be listed
+        :param batch_size: Maximum amount of items in one batch
+        :return: generator of lists of Files and Folders (objects)
+        """
+        return self.listing(folder, batch_size)[1]
+
+    def listing(self, folder, batch_size=1000):
+        """
+        Lists folder, from cache when possible
+        :param folder: Folder to be listed
+        :param batch_size: Maximum amount of items in one batch
+        :return: tuple (version, generator of lists of Files and Folders), the version
+                 can be passed to get_changes to get what changed since this listing
+        """
+        path = folder.get_path()
+        with self._lock:
+            self._read_events()
+            snap = self._validate(path)
+            if snap is not None:
+                return snap.get_version(), self._iter_cached(list(snap.items.values()), batch_size)
+            # Watch is added before listing so that no change is missed
+            snap = _Snapshot(path, os.stat(path).st_mtime_ns, None)
+            self._drop(path)
+            self._snapshots[path] = snap
+            snap.wd = self._watch(path)
+            return snap.get_version(), self._iter_listed(folder, snap, batch_size)
+
+    def get_changes(self, path, version):
+        """
+        :param path: Path of the folder
+        :param version: Version returned by listing or previous get_changes call
+        :return: tuple (new version, dict name -> Item for added and changed items and
+                 name -> None for removed ones) or None if the changes are not known
+                 and the folder has to be listed again
+        """
+        with self._lock:
+            self._read_events()
+            snap = self._validate(path)
+            if snap is None or snap.id != version[0] or version[1] < snap.oldest:
+                return None
+            updates = {name: snap.items[name]._duplicate() if name in snap.items else None
+                       for name, v in snap.changes.items() if v > version[1]}
+            return snap.get_version(), updates
+
+    def poll(self):
+        """
+        Processes queued inotify events and checks folders which are not watched
+        :return: set of paths of cached folders which changed since the last poll
+        """
+        with self._lock:
+            self._read_events()
+            for path, snap in list(self._snapshots.items()):
+                if snap.wd is None and snap.items is not None:
+                    try:
+                        mtime = os.stat(path).st_mtime_ns
+                    except OSError:
+                        mtime = None
+                    if mtime != snap.mtime:
+                        self._drop(path)
+                        self._changed.add(path)
+            changed = self._changed
+            self._changed = set()
+        return changed
+
+    def invalidate(self, path):
+        """
+        Drops cached listing of the folder
+        """
+        with self._lock:
+            self._drop(path)
+
+    def _iter_cached(self, items, batch_size):
+        for i in range(0, len(items), batch_size):
+            yield [item._duplicate() for item in items[i:i + batch_size]]
+
+    def _iter_listed(self, folder, snap, batch_size):
+        listed = {}
+        done = False
+        try:
+            for batch in folder.iter_content(batch_size):
+                listed.update((i.get_name(), i._duplicate()) for i in batch)
+                yield batch
+            done = True
+        finally:
+            with self._lock:
+                if self._snapshots.get(snap.path) is snap:
+                    if done:
+                        snap.items = listed
+                        self._evict()
+                    else:  # Listing failed or was abandoned
+                        self._drop(snap.path)
+
+    def _validate(self, path):
+        """
+        Brings cached listing up to date
+        :return: _Snapshot or None if the folder is not cached or has to be listed again
+        """
+        snap = self._snapshots.get(path)
+        if snap is None or snap.items is None:
+            return None
+        if snap.wd is None:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != snap.mtime:
+                self._drop(path)
+                return None
+        for name in snap.pending:
+            item = stat_item(join(path, name))
+            if item is None:
+                snap.items.pop(name, None)
+            else:
+                snap.items[name] = item
+        snap.pending.clear()
+        self._snapshots.move_to_end(path)
+        return snap
+
+    def _read_events(self):
+        if self._inotify is None:
+            return
+        for wd, mask, name in self._inotify.read_events():
+            if mask & Inotify.IN_Q_OVERFLOW:  # Events were lost
+                self._changed.update(self._snapshots.keys())
+                for path in list(self._snapshots):
+                    self._drop(path)
+                continue
+            path = self._watches.get(wd)
+            if path is None:
+                continue
+            self._changed.add(path)
+            if mask & (Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF | Inotify.IN_IGNORED):
+                self._drop(path)
+            elif len(name) > 0:
+                snap = self._snapshots[path]
+                snap.version += 1
+                snap.changes[name] = snap.version
+                snap.changes.move_to_end(name)
+                if len(snap.changes) > DirectoryCache.MAX_CHANGES:
+                    snap.oldest = snap.changes.popitem(last=False)[1]
+                snap.pending.add(name)
+
+    def _watch(self, path):
+        if self._inotify is None or self._is_polled(path):
+            return None
+        try:
+            wd = self._inotify.add_watch(path, DirectoryCache.WATCH_MASK)
+        except OSError:  # Out of watches or not supported
+            return None
+        if self._watches.get(wd, path) != path:  # Same folder under another path
+            return None
+        self._watches[wd] = path
+        return wd
+
+    def _is_polled(self, path):
+        mount, fstype = "", ""
+        try:
+            mounts = FileManager.disks.get_mounts()
+        except Exception:
+            return False
+        for mountpoint, fs in mounts:
+            if (path == mountpoint or path.startswith(mountpoint.rstrip("/") + "/")) and len(mountpoint) > len(mount):
+                mount, fstype = mountpoint, fs
+        return fstype in DirectoryCache.POLLED_FS
+
+    def _drop(self, path):
+        snap = self._snapshots.pop(path, None)
+        if snap is not None and snap.wd is not None:
+            del self._watches[snap.wd]
+            self._inotify.rm_watch(snap.wd)
+
+    def _evict(self):
+        while len(self._snapshots) > self._max_folders:
+            path = next(iter(self._snapshots))
+            self._drop(path)
+            # Changes of the folder are not followed anymore, a panel showing it has to list it again
+            self._changed.add(path)
+
+
+class FilenameIndex:
+    """
+    Persistent index of file and folder names on one disk
+    Index is stored in SQLite with a trigram full text index, so a name can be
+    found anywhere on the disk without walking it. Index is built in a background
+    thread, only folders whose modification time changed are written again and
+    single folders can be updated when they change.
+    """
+
+    INDEX_DIR = join(os.environ.get("XDG_CACHE_HOME", join(os.path.expanduser("~"), ".cache")),
+                     "itu-file-explorer", "index")
+    MAX_RESULTS = 1000
+    MAX_AGE = 24 * 60 * 60  # Index older than this (in seconds) is rebuilt when queried
+    COMMIT_EVERY = 1000  # folders
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value);
+        CREATE TABLE IF NOT EXISTS dirs(id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime INTEGER, gen INTEGER);
+        CREATE TABLE IF NOT EXISTS entries(id INTEGER PRIMARY KEY, dir_id INTEGER, name TEXT, is_dir INTEGER);
+        CREATE INDEX IF NOT EXISTS entries_dir ON entries(dir_id);
+    """
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(name, content='entries', content_rowid='id',
+                                                             tokenize='trigram');
+        CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+            INSERT INTO names(rowid, name) VALUES (new.id, new.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+            INSERT INTO names(names, rowid, name) VALUES ('delete', old.id, old.name);
+        END;
+    """
+
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
+    @staticmethod
+    def get(root):
+        """
+        :param root: Mount point of the disk
+        :return: FilenameIndex of the disk (shared)
+        """
+        with FilenameIndex._indexes_lock:
+            if root not in FilenameIndex._indexes:
+                FilenameIndex._indexes[root] = FilenameIndex(root)
+            return FilenameIndex._indexes[root]
+
+    @staticmethod
+    def folder_changed(path):
+        """
+        Updates folder in all opened indexes which contain it
+        """
+        with FilenameIndex._indexes_lock:
+            indexes = list(FilenameIndex._indexes.values())
+        for i in indexes:
+            i.update_folder(path)
+
+    def __init__(self, root):
+        self._root = root
+        self._db_path = join(FilenameIndex.INDEX_DIR, hashlib.sha1(os.fsencode(root)).hexdigest() + ".sqlite")
+        self._local = threading.local()
+        self._tasks = queue.Queue()
+        self._worker = None
+        self._building = False
+        self._built_callbacks = []
+        self._lock = threading.Lock()
+        self._fts = True
+        self._dev = None
+
+    def contains(self, path):
+        """
+        :return: If the path is on this index's disk (folders of other disks mounted inside are not)
+        """
+        if path != self._root and not path.startswith(self._root.rstrip("/") + "/"):
+            return False
+        try:
+            if self._dev is None:
+                self._dev = os.stat(self._root).st_dev
+            return os.stat(path).st_dev == self._dev
+        except OSError:
+            return False
+
+    def is_building(self):
+        return self._building
+
+    def get_build_time(self):
+        """
+        :return: Time of the last finished build or None if the index was not built yet
+        """
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+        return row[0] if row is not None else None
+
+    def build(self, built=None):
+        """
+        Starts building of the index in background
+        :param built: Called with the disk's root from the worker thread once the build finishes (optional)
+        """
+        with self._lock:
+            if built is not None:
+                self._built_callbacks.append(built)
+            if self._building:
+                return
+            self._building = True
+        self._submit("build", self._root)
+
+    def update_folder(self, path):
+        """
+        Updates names in one folder in background (new subfolders are indexed too)
+        """
+        if self.contains(path):
+            self._submit("update", path)
+
+    def query(self, text, limit=MAX_RESULTS, built=None):
+        """
+        Index is built first time it is queried, until then results are incomplete (see is_building)
+        Runs SQLite queries, so it should not be called from GUI thread
+        :param text: Part of the name, * matches anything
+        :param limit: Maximum amount of results
+        :param built: Called with the disk's root from the worker thread once the index is built,
+                      if it is being built now (optional)
+        :return: list of Files and Folders (objects) whose name contains the text
+        :raise: sqlite3.Error or OSError if the index cannot be read
+        """
+        build_time = self.get_build_time()
+        if self._building or build_time is None or time.time() - build_time > FilenameIndex.MAX_AGE:
+            self.build(built)
+        escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = "%" + escaped.replace("*", "%") + "%"
+        # Trigram index is not used for LIKE with ESCAPE, so it is added only when needed
+        like = "LIKE ?" if escaped == text else "LIKE ? ESCAPE '\\'"
+        if self._fts:
+            sql = "SELECT d.path, e.name, e.is_dir FROM names JOIN entries e ON e.id = names.rowid " \
+                  "JOIN dirs d ON d.id = e.dir_id WHERE names.name {} LIMIT ?".format(like)
+        else:
+            sql = "SELECT d.path, e.name, e.is_dir FROM entries e JOIN dirs d ON d.id = e.dir_id " \
+                  "WHERE e.name {} LIMIT ?".format(like)
+        rows = self._connect().execute(sql, (pattern, limit)).fetchall()
+        return [Folder(join(p, n)) if d else File(join(p, n)) for p, n, d in rows]
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(FilenameIndex.INDEX_DIR, exist_ok=True)
+            conn = sqlite3.connect(self._db_path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(FilenameIndex.SCHEMA)
+            try:
+                conn.executescript(FilenameIndex.FTS_SCHEMA)
+            except sqlite3.OperationalError:  # SQLite without FTS5 or trigram tokenizer
+                self._fts = False
+            self._local.conn = conn
+        return conn
+
+    def _submit(self, task, path):
+        self._tasks.put((task, path))
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            task, path = self._tasks.get()
+            apply_background_priority()
+            try:
+                if task == "build":
+                    self._index_tree(path, True)
+                else:
+                    self._update_folder(path)
+            except (OSError, sqlite3.Error):
+                pass
+            except Exception as e:  # The updater has to keep running for the other tasks
+                print("Filename index could not {} {} - {}".format(task, path, repr(e)), file=sys.stderr)
+            finally:
+                if task == "build":
+                    with self._lock:
+                        self._building = False
+                        callbacks, self._built_callbacks = self._built_callbacks, []
+                    for c in callbacks:
+                        c(self._root)
+
+    def _index_tree(self, top, full=False):
+        conn = self._connect()
+        dev = os.stat(self._root).st_dev
+        gen = time.time_ns()
+        stack = [top]
+        done = 0
+        while len(stack) > 0:
+            try:
+                stack.extend(self._index_folder(conn, stack.pop(), dev, gen))
+            except OSError:
+                continue
+            done += 1
+            if done % FilenameIndex.COMMIT_EVERY == 0:
+                conn.commit()
+        if full:  # Remove folders which were not found
+            conn.execute("DELETE FROM entries WHERE dir_id IN (SELECT id FROM dirs WHERE gen < ?)", (gen,))
+            conn.execute("DELETE FROM dirs WHERE gen < ?", (gen,))
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('built', ?)", (time.time(),))
+        conn.commit()
+
+    def _index_folder(self, conn, path, dev, gen):
+        """
+        Writes names in the folder if it changed since it was indexed
+        :return: list of paths of subfolders on the same disk
+        """
+        mtime = os.stat(path).st_mtime_ns
+        with os.scandir(path) as it:
+            entries = list(it)
+        subdirs = [e.path for e in entries
+                   if e.is_dir(follow_symlinks=False) and e.stat(follow_symlinks=False).st_dev == dev]
+        row = conn.execute("SELECT id, mtime FROM dirs WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            dir_id = conn.execute("INSERT INTO dirs(path, mtime, gen) VALUES (?, ?, ?)", (path, mtime, gen)).lastrowid
+        else:
+            dir_id = row[0]
+            conn.execute("UPDATE dirs SET mtime = ?, gen = ? WHERE id = ?", (mtime, gen, dir_id))
+            if row[1] == mtime:  # Names did not change
+                return subdirs
+            conn.execute("DELETE FROM entries WHERE dir_id = ?", (dir_id,))
+        conn.executemany("INSERT INTO entries(dir_id, name, is_dir) VALUES (?, ?, ?)",
+                         [(dir_id, e.name, e.is_dir()) for e in entries])
+        return subdirs
+
+    def _update_folder(self, path):
+        conn = self._connect()
+        old = set(r[0] for r in conn.execute("SELECT path FROM dirs WHERE path >= ? AND path < ?",
+                                             (path.rstrip("/") + "/", path.rstrip("/") + "0")))
+        subdirs = self._index_folder(conn, path, os.stat(self._root).st_dev, time.time_ns())
+        for d in subdirs:  # New subfolders
+            if d not in old:
+                self._index_tree(d)
+        for d in set(join(path, os.path.relpath(p, path).split(os.sep)[0]) for p in old) - set(subdirs):
+            # Removed subfolders
+            rng = (d, d + "/", d + "0")
+            conn.execute("DELETE FROM entries WHERE dir_id IN (SELECT id FROM dirs WHERE path = ? OR "
+                         "(path >= ? AND path < ?))", rng)
+            conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", rng)
+        conn.commit()
+
+
+class FolderSizes:
+    """
+    Sizes and item counts of folders computed in background by a pool of workers
+    Results are cached by folder's inode and modification time, a change in a folder
+    reported by the cache marks the folder and all its parents stale. Stale sizes are
+    computed again once they are asked for (the old size is returned meanwhile)
+    """
+
+    WORKERS = 4
+
+    def __init__(self, workers=WORKERS):
+        self._lock = threading.Lock()
+        self._sizes = {}  # path -> ((inode, mtime), size, item count, stale)
+        self._running = {}  # path -> threading.Event cancelling the computation
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="folder-size")
+
+    def get(self, folder, callback=None):
+        """
+        :param folder: Folder object (its cached stat info is used)
+        :param callback: Called with folder's path from a worker thread once the size is computed
+        :return: tuple (size in bytes, item count) or None if it is not known yet,
+                 in that case it is computed in background
+                 Size and count are None if the folder could not be measured
+        """
+        path = folder.get_path()
+        try:
+            st = folder.get_stat()
+        except OSError:
+            return None, None
+        key = (st.st_ino, st.st_mtime_ns)
+        with self._lock:
+            cached = self._sizes.get(path)
+            if cached is not None and cached[0] == key and not cached[3]:
+                return cached[1], cached[2]
+            if path not in self._running:
+                self._running[path] = threading.Event()
+                self._pool.submit(self._compute, path, key, callback, self._running[path])
+            if cached is not None and cached[0] == key:  # Stale, but still the best known size
+                return cached[1], cached[2]
+        return None
+
+    def peek(self, folder):
+        """
+        Same as get, but the size is never computed
+        :return: tuple (size in bytes, item count) or None if it is not known
+        """
+        try:
+            st = folder.get_stat()
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._sizes.get(folder.get_path())
+            if cached is not None and cached[0] == (st.st_ino, st.st_mtime_ns):
+                return cached[1], cached[2]
+        return None
+
+    def cancel(self, parent):
+        """
+        Cancels computations of sizes of folders inside of the parent folder
+        """
+        prefix = parent.rstrip("/") + "/"
+        with self._lock:
+            for path, cancel in self._running.items():
+                if path.startswith(prefix):
+                    cancel.set()
+
+    def invalidate(self, path):
+        """
+        Marks cached size of the folder and of all its parents stale
+        """
+        with self._lock:
+            while True:
+                cached = self._sizes.get(path)
+                if cached is not None:
+                    self._sizes[path] = cached[:3] + (True,)
+                if path in self._running:  # May have missed the change, computed again when asked for
+                    self._running[path].set()
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+    def _compute(self, path, key, callback, cancel):
+        apply_background_priority()
+        try:
+            stats = Folder(path).walk(cancel=cancel, one_filesystem=True)
+        except OperationCancelledException:
+            with self._lock:
+                del self._running[path]
+            return
+        with self._lock:
+            del self._running[path]
+            self._sizes[path] = (key, stats.size, stats.get_item_count(), False)
+        if callback is not None:
+            callback(path)
+
+
+_libc = None
+
+
+def sync_files(paths, directory):
+    """
+    Makes data of the files durable, only the filesystem of the directory is synced by syncfs
+    where it is available (Linux), otherwise every file is fsync-ed
+    :param paths: Paths of the written files
+    :param directory: Folder on the filesystem to which the files were written
+    """
+    global _libc
+    if len(paths) == 0:
+        return
+    if sys.platform.startswith("linux"):
+        if _libc is None:
+            _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            fd = None
+        if fd is not None:
+            try:
+                if _libc.syncfs(fd) == 0:
+                    return
+            finally:
+                os.close(fd)
+    for path in set(paths):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:  # Removed meanwhile, its record does not matter
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class TransferJournal:
+    """
+    JSON lines file recording progress of a transfer, so it can be resumed after the app
+    was closed or crashed. First line describes the transfer, the others record copied files,
+    copied ranges of large files and the start of removing the source of a move.
+    Copies are recorded with size and modification time of their source, so sources
+    changed in between are copied again.
+    Records are written in batches after the copied data were synced to disk.
+    """
+
+    JOURNAL_DIR = join(os.environ.get("XDG_CACHE_HOME", join(os.path.expanduser("~"), ".cache")),
+                       "itu-file-explorer", "transfers")
+    FLUSH_INTERVAL = 5  # seconds
+
+    def __init__(self, path, header, resumed=False):
+        """
+        :param path: Path of the journal file
+        :param header: Description of the transfer (the first line)
+        :param resumed: If the journal was loaded to resume the transfer
+        """
+        self.path = path
+        self.source = header["source"]
+        self.destination = header["destination"]
+        self.to = header["to"]
+        self.move = header["move"]
+        self.verify = header["verify"]
+        self.folder = header["folder"]
+        self.resumed = resumed
+        self.removing = False
+        self._files = {}  # destination -> (source size, source mtime)
+        self._ranges = {}  # destination -> ((source size, source mtime), set of (offset, length))
+        self._pending = []
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:  # Resumed by another running instance
+                self._file.close()
+                raise
+
+    @staticmethod
+    def create(job):
+        """
+        :param job: TransferJob with the destination already set
+        :return: New TransferJournal for the job
+        """
+        os.makedirs(TransferJournal.JOURNAL_DIR, exist_ok=True)
+        header = {"source": job.item.get_path(), "destination": job.destination, "to": job.to,
+                  "move": job.move, "verify": job.verify, "folder": job.item.is_folder()}
+        path = join(TransferJournal.JOURNAL_DIR, "{}-{}.jsonl".format(os.getpid(), id(job)))
+        journal = TransferJournal(path, header)
+        journal._file.write(json.dumps(header) + "\n")
+        journal._file.flush()
+        return journal
+
+    @staticmethod
+    def load_all():
+        """
+        :return: List of journals of interrupted transfers which are not resumed by other instance
+        """
+        journals = []
+        try:
+            names = sorted(os.listdir(TransferJournal.JOURNAL_DIR))
+        except OSError:
+            return journals
+        for name in names:
+            path = join(TransferJournal.JOURNAL_DIR, name)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    lines = f.read().splitlines()
+                journal = TransferJournal(path, json.loads(lines[0]), True)
+            except (OSError, ValueError, KeyError, IndexError):
+                continue
+            for line in lines[1:]:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # Last line written only partially
+                    break
+                if "file" in record:
+                    journal._files[record["file"]] = (record.get("size"), record.get("mtime"))
+                elif "range" in record:
+                    source = (record.get("size"), record.get("mtime"))
+                    ranges = journal._ranges.get(record["range"])
+                    if ranges is None or ranges[0] != source:
+                        ranges = journal._ranges[record["range"]] = (source, set())
+                    ranges[1].add((record["offset"], record["length"]))
+                elif record.get("phase") == "remove":
+                    journal.removing = True
+            journals.append(journal)
+        return journals
+
+    def is_done(self, path, st):
+        """
+        :param path: Destination of the file
+        :param st: Current os.stat_result of the source
+        :return: If the file was copied before the transfer was interrupted, its source did not change
+                 and the copy was not removed or truncated since
+        """
+        return self._files.get(path) == (st.st_size, st.st_mtime_ns) and TransferJournal._has_size(path, st.st_size)
+
+    def get_ranges(self, path, st):
+        """
+        :param path: Destination of the file
+        :param st: Current os.stat_result of the source
+        :return: Set of (offset, length) of ranges of a large file copied before the transfer was interrupted,
+                 empty if the source changed or the copy was removed or truncated since
+        """
+        ranges = self._ranges.get(path)
+        if ranges is None or ranges[0] != (st.st_size, st.st_mtime_ns) or \
+                not TransferJournal._has_size(path, st.st_size):
+            return set()
+        return ranges[1]
+
+    @staticmethod
+    def _has_size(path, size):
+        try:
+            return os.stat(path).st_size == size
+        except OSError:
+            return False
+
+    def file_done(self, path, st):
+        self._add({"file": path, "size": st.st_size, "mtime": st.st_mtime_ns})
+
+    def range_done(self, path, offset, length, st):
+        self._add({"range": path, "offset": offset, "length": length, "size": st.st_size, "mtime": st.st_mtime_ns})
+
+    def copy_finished(self):
+        """
+        Records that the copy of a move is finished and the source is being removed
+        """
+        self._add({"phase": "remove"})
+        self.flush()
+
+    def flush(self):
+        """
+        Writes pending records once the data they describe are on the disk
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._flushed = time.monotonic()
+            if not pending:
+                return
+            sync_files([r.get("file") or r.get("range") for r in pending if "file" in r or "range" in r],
+                       self.to)
+            self._file.write("".join(json.dumps(r) + "\n" for r in pending))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def remove(self):
+        """
+        Deletes the journal of a finished transfer
+        """
+        with self._lock:
+            self._file.close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Closes the journal, so the transfer can be resumed later
+        """
+        self.flush()
+        with self._lock:
+            self._file.close()
+
+    def _add(self, record):
+        with self._lock:
+            self._pending.append(record)
+            due = time.monotonic() - self._flushed >= TransferJournal.FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+
+class TransferJob:
+    """
+    Copying or moving of one item done in background by TransferQueue
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    PAUSED = "paused"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    SPEED_WINDOW = 5  # Seconds from which the speed is computed
+
+    def __init__(self, transfers, item, to, move=False, rename_duplicit=True, verify=False, journal=None,
+                 rate_limit=0, iops_limit=0, delete=False):
+        """
+        :param transfers: TransferQueue running this job
+        :param item: File or Folder object to be copied or moved
+        :param to: folder to which to copy or move (object or address)
+        :param move: If the item is moved instead of copied
+        :param rename_duplicit: renames the item by appending number to it if
+                                there already is an item with the same name
+        :param verify: Copied data are checked against the source (see copy_file)
+        :param journal: TransferJournal of an interrupted transfer which is resumed (optional)
+        :param rate_limit: Maximum bytes per second (0 for no limit)
+        :param iops_limit: Maximum read and write operations per second (0 for no limit)
+        :param delete: If the item is permanently removed instead (to is None then and
+                       the progress is in items instead of bytes)
+        """
+        self.item = item
+        self.to = to.get_path() if type(to) == Folder else to
+        self.move = move
+        self.delete = delete
+        self.rename_duplicit = rename_duplicit
+        self.verify = verify
+        self.journal = journal
+        self.destination = journal.destination if journal is not None else None
+        self.result = None
+        self.error = None
+        self.total = None
+        self.done = 0
+        self.methods = collections.Counter()  # copy method -> amount of files copied by it
+        self.cancelled = threading.Event()
+        self._bytes = TokenBucket(rate_limit)
+        self._iops = TokenBucket(iops_limit)
+        self._transfers = transfers
+        self._lock = threading.Lock()
+        self._state = TransferJob.QUEUED
+        self._started = False
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._samples = collections.deque()  # (time, bytes done)
+        self.devices = set()
+        for path in (item.get_path(), self.to):
+            if path is None:
+                continue
+            try:
+                self.devices.add(os.lstat(path).st_dev)
+            except OSError:
+                pass
+
+    def get_state(self):
+        return self._state
+
+    def is_resumed(self):
+        """
+        :return: If the job continues a transfer interrupted before
+        """
+        return self.journal is not None and self.journal.resumed
+
+    def copy_finished(self):
+        """
+        Called by the moving code once the item is copied and its source is going to be removed
+        """
+        if self.journal is not None:
+            self.journal.copy_finished()
+
+    def is_finished(self):
+        return self._state in (TransferJob.DONE, TransferJob.FAILED, TransferJob.CANCELLED)
+
+    def get_progress(self):
+        """
+        :return: Done part of the job from 0 to 1 or None if the size is not known yet
+        """
+        if self._state == TransferJob.DONE:
+            return 1.0
+        if not self.total:
+            return None
+        return min(self.done / self.total, 1.0)
+
+    def get_speed(self):
+        """
+        :return: Bytes per second over the last few seconds
+        """
+        with self._lock:
+            if self._state != TransferJob.RUNNING or not self._samples:
+                return 0
+            since, done = self._samples[0]
+            elapsed = time.monotonic() - since
+            return (self.done - done) / elapsed if elapsed > 0 else 0
+
+    def get_eta(self):
+        """
+        :return: Estimated remaining time in seconds or None if it can not be estimated
+        """
+        speed = self.get_speed()
+        if not speed or not self.total:
+            return None
+        return max(self.total - self.done, 0) / speed
+
+    def set_total(self, total):
+        """
+        Called by the copying code once the amount of bytes to be copied is known
+        """
+        self._check()
+        self.total = total
+
+    def add_method(self, method):
+        """
+        Called by the copying code after each file with the name of the method which copied it
+        """
+        with self._lock:
+            self.methods[method] += 1
+
+    def get_methods(self):
+        """
+        :return: Names of the methods used for copying, the most used first
+        """
+        with self._lock:
+            return [m for m, _ in self.methods.most_common()]
+
+    def get_limits(self):
+        """
+        :return: tuple (bytes per second, operations per second), 0 means no limit
+        """
+        return self._bytes.rate, self._iops.rate
+
+    def set_limits(self, rate_limit, iops_limit):
+        """
+        :param rate_limit: Maximum bytes per second (0 for no limit)
+        :param iops_limit: Maximum read and write operations per second (0 for no limit)
+        """
+        self._bytes.set_rate(rate_limit)
+        self._iops.set_rate(iops_limit)
+
+    def update(self, copied, io=True):
+        """
+        Called by the copying code after each copied chunk, blocks while the job is paused
+        or while it is over its rate limits
+        :param copied: Amount of bytes copied since the last update (items removed for deleting,
+                       each removal is one operation)
+        :param io: If the bytes were really read and written (not skipped or cloned)
+        :raise: OperationCancelledException if the job was cancelled
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.done += copied
+            self._samples.append((now, self.done))
+            while len(self._samples) > 2 and now - self._samples[0][0] > TransferJob.SPEED_WINDOW:
+                self._samples.popleft()
+        if self.delete:
+            self._iops.consume(copied, self.cancelled)
+        elif io:
+            self._bytes.consume(copied, self.cancelled)
+            self._iops.consume(1, self.cancelled)
+        self._check()
+
+    def pause(self):
+        with self._lock:
+            if self._state in (TransferJob.QUEUED, TransferJob.RUNNING):
+                self._state = TransferJob.PAUSED
+                self._resumed.clear()
+
+    def resume(self):
+        with self._lock:
+            if self._state != TransferJob.PAUSED:
+                return
+            self._samples.clear()
+            self._state = TransferJob.RUNNING if self._started else TransferJob.QUEUED
+            self._resumed.set()
+        self._transfers.schedule()
+
+    def cancel(self):
+        with self._lock:
+            if self.is_finished():
+                return
+            self.cancelled.set()
+            if not self._started:
+                self._state = TransferJob.CANCELLED
+            self._resumed.set()
+
+    def _check(self):
+        self._resumed.wait()
+        if self.cancelled.is_set():
+            raise OperationCancelledException()
+
+    def _start(self):
+        """
+        :return: If the job was waiting in the queue and now can be run
+        """
+        with self._lock:
+            if self._state != TransferJob.QUEUED:
+                return False
+            self._state = TransferJob.RUNNING
+            self._started = True
+            return True
+
+    def _finish(self, state):
+        with self._lock:
+            self._state = state
+            self._resumed.set()
+
+    def _start_journal(self):
+        """
+        Picks the destination of a new transfer and starts its journal, resumed transfers already have both
+        """
+        if self.journal is None:
+            self.destination = self._transfers.claim_destination(self.item, self.to, self.rename_duplicit)
+            try:
+                self.journal = TransferJournal.create(self)
+            except OSError:
+                pass  # Transfer just can't be resumed
+
+    def run(self):
+        """
+        Copies, moves or removes the item, partially copied destination is removed when the job is cancelled
+        Progress of copying is recorded in a journal, which is removed once the job ends
+        """
+        try:
+            if self.delete:
+                self.item.remove(self)
+            elif self.move and self.is_resumed() and \
+                    (self.journal.removing or not os.path.lexists(self.item.get_path())):
+                # Interrupted while removing the source or after it was renamed
+                if os.path.lexists(self.item.get_path()):
+                    self.item.remove()
+                self.item._set_path(self.destination)
+                self.result = self.item
+            elif self.move:
+                self._start_journal()
+                self.item._move_to(self.destination, self, self.verify)
+                self.result = self.item
+            else:
+                self._start_journal()
+                self.result = self.item._copy_to(self.destination, self, self.verify)
+        except OperationCancelledException:
+            # Destination is touched only after the total size is known
+            if self.total is not None and self.destination is not None and os.path.lexists(self.destination):
+                try:
+                    if os.path.isdir(self.destination) and not os.path.islink(self.destination):
+                        shutil.rmtree(self.destination)
+                    else:
+                        os.remove(self.destination)
+                except OSError:
+                    pass
+            self._finish(TransferJob.CANCELLED)
+        except Exception as e:
+            self.error = str(e)
+            self._finish(TransferJob.FAILED)
+        else:
+            self._finish(TransferJob.DONE)
+        if self.journal is not None:
+            self.journal.remove()
+        if self.destination is not None:
+            self._transfers.release_destination(self.destination)
+
+
+class TransferQueue:
+    """
+    Runs copy and move jobs on worker threads
+    At most jobs_per_device jobs reading or writing the same device run at once,
+    the others wait in the queue
+    """
+
+    JOBS_PER_DEVICE = 2
+
+    def __init__(self, jobs_per_device=JOBS_PER_DEVICE):
+        self.jobs_per_device = jobs_per_device
+        self.rate_limit = 0  # Limits of new jobs, see TransferJob
+        self.iops_limit = 0
+        self._lock = threading.Lock()
+        self._jobs = []
+        self._running = collections.Counter()  # device -> amount of running jobs
+        self._claimed = set()  # Destinations of running jobs, so no two jobs pick the same new name
+
+    def add(self, item, to, move=False, rename_duplicit=True, verify=False):
+        """
+        Queues copying or moving of an item
+        :param item: File or Folder object
+        :param to: folder to which to copy or move (object or address)
+        :param move: If the item is moved instead of copied
+        :param rename_duplicit: renames the item by appending number to it if
+                                there already is an item with the same name
+        :param verify: Copied data are checked against the source (see copy_file)
+        :return: TransferJob object
+        """
+        job = TransferJob(self, item, to, move, rename_duplicit, verify,
+                          rate_limit=self.rate_limit, iops_limit=self.iops_limit)
+        with self._lock:
+            self._jobs.append(job)
+        self.schedule()
+        return job
+
+    def claim_destination(self, item, to, rename_duplicit):
+        """
+        Picks destination of a job and reserves it until release_destination is called
+        :return: Path of the copied or moved item
+        """
+        with self._lock:
+            path = item.get_destination(to, rename_duplicit, self._claimed)
+            self._claimed.add(path)
+            return path
+
+    def release_destination(self, path):
+        with self._lock:
+            self._claimed.discard(path)
+
+    def add_removal(self, item):
+        """
+        Queues permanent removal of an item
+        :param item: File or Folder object
+        :return: TransferJob object
+        """
+        job = TransferJob(self, item, None, delete=True,
+                          rate_limit=self.rate_limit, iops_limit=self.iops_limit)
+        with self._lock:
+            self._jobs.append(job)
+        self.schedule()
+        return job
+
+    def resume_interrupted(self):
+        """
+        Queues transfers which were interrupted by closing or crash of the app
+        :return: List of the resumed jobs
+        """
+        jobs = []
+        for journal in TransferJournal.load_all():
+            item = Folder(journal.source) if journal.folder else File(journal.source)
+            job = TransferJob(self, item, journal.to, journal.move, False, journal.verify, journal,
+                              self.rate_limit, self.iops_limit)
+            with self._lock:
+                self._jobs.append(job)
+                self._claimed.add(journal.destination)
+            jobs.append(job)
+        self.schedule()
+        return jobs
+
+    def get_jobs(self):
+        """
+        :return: List of all jobs in the order in which they were added
+        """
+        with self._lock:
+            return list(self._jobs)
+
+    def is_active(self):
+        """
+        :return: If there are any unfinished jobs
+        """
+        with self._lock:
+            return any(not job.is_finished() for job in self._jobs)
+
+    def flush_journals(self):
+        """
+        Writes progress of unfinished jobs, so they can be resumed after the app is closed
+        """
+        for job in self.get_jobs():
+            if job.journal is not None and not job.is_finished():
+                try:
+                    job.journal.flush()
+                except (OSError, ValueError):  # Journal was just closed
+                    pass
+
+    def clear_finished(self):
+        with self._lock:
+            self._jobs = [job for job in self._jobs if not job.is_finished()]
+
+    def schedule(self):
+        """
+        Starts queued jobs whose devices are not busy
+        """
+        with self._lock:
+            for job in self._jobs:
+                if job.get_state() != TransferJob.QUEUED:
+                    continue
+                if any(self._running[dev] >= self.jobs_per_device for dev in job.devices):
+                    continue
+                if job._start():
+                    for dev in job.devices:
+                        self._running[dev] += 1
+                    threading.Thread(target=self._run, args=(job,), name="transfer", daemon=True).start()
+
+    def _run(self, job):
+        try:
+            apply_background_priority()
+            job.run()
+        finally:
+            with self._lock:
+                for dev in job.devices:
+                    self._running[dev] -= 1
+            self.schedule()
+
+
+class TrashItem:
+    """
+    Item moved to trash, see Trash
+    """
+
+    def __init__(self, trash_dir, name, path, deleted):
+        """
+        :param trash_dir: Trash folder containing the item
+        :param name: Name of the item in the trash
+        :param path: Original path of the item
+        :param deleted: Time of the removal (timestamp)
+        """
+        self.trash_dir = trash_dir
+        self.name = name
+        self.path = path
+        self.deleted = deleted
+
+    def get_trashed_path(self):
+        return join(self.trash_dir, "files", self.name)
+
+    def get_info_path(self):
+        return join(self.trash_dir, "info", self.name + ".json")
+
+
+class Trash:
+    """
+    Removing by renaming into a trash folder on the same device, so it takes constant time
+    and it can be undone. Trashed items are removed in background once they are older than KEEP.
+    Trash of the home device is in the data folder, other devices have .itu-trash-<uid>
+    in their mount point. Each trash has "files" folder with the items and "info" folder
+    with their original paths.
+    """
+
+    HOME_TRASH = join(os.environ.get("XDG_DATA_HOME", join(os.path.expanduser("~"), ".local", "share")),
+                      "itu-file-explorer", "trash")
+    KEEP = 7 * 24 * 60 * 60  # seconds
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirs = {}  # device -> trash folder
+        self._counter = itertools.count()
+        self._purging = False
+
+    def get_trash_dir(self, path):
+        """
+        :param path: Path of a trashed item
+        :raise: OSError if the device has no usable trash folder
+        :return: Path of the trash folder on the same device as the path
+        """
+        dev = os.lstat(path).st_dev
+        with self._lock:
+            if dev in self._dirs:
+                return self._dirs[dev]
+        os.makedirs(Trash.HOME_TRASH, exist_ok=True)
+        if os.stat(Trash.HOME_TRASH).st_dev == dev:
+            trash_dir = Trash.HOME_TRASH
+        else:
+            mount = os.path.dirname(os.path.abspath(path))
+            while not os.path.ismount(mount):
+                mount = os.path.dirname(mount)
+            trash_dir = join(mount, ".itu-trash-{}".format(os.getuid() if hasattr(os, "getuid") else "user"))
+            try:
+                os.mkdir(trash_dir, mode=0o700)
+            except FileExistsError:
+                pass
+            Trash._check_owner(trash_dir)
+        for sub in ("files", "info"):
+            os.makedirs(join(trash_dir, sub), mode=0o700, exist_ok=True)
+        if os.stat(trash_dir).st_dev != dev:
+            raise OSError(errno.EXDEV, "No trash on the device of {}".format(path))
+        with self._lock:
+            self._dirs[dev] = trash_dir
+        return trash_dir
+
+    @staticmethod
+    def _check_owner(trash_dir):
+        """
+        Trash folder in a shared mount point could be made by another user to receive trashed items
+        :raise: OSError if the folder is a symlink, is not owned by the current user or others can access it
+        """
+        st = os.lstat(trash_dir)
+        if not S_ISDIR(st.st_mode) or (hasattr(os, "getuid") and st.st_uid != os.getuid()) \
+                or S_IMODE(st.st_mode) != 0o700:
+            raise OSError(errno.EPERM, "Trash folder {} is not private".format(trash_dir))
+
+    def put(self, item):
+        """
+        :param item: File or Folder object
+        :raise: OSError if the device has no usable trash folder
+        :return: TrashItem object
+        """
+        path = os.path.abspath(item.get_path())
+        trash_dir = self.get_trash_dir(path)
+        trashed = TrashItem(trash_dir, "{}-{}-{}".format(time.time_ns(), next(self._counter), item.get_name()),
+                            path, time.time())
+        with open(trashed.get_info_path(), "w", encoding="utf-8") as f:
+            json.dump({"path": trashed.path, "deleted": trashed.deleted}, f)
+        try:
+            os.rename(path, trashed.get_trashed_path())
+        except OSError:
+            os.remove(trashed.get_info_path())
+            raise
+        return trashed
+
+    def restore(self, trashed):
+        """
+        Moves trashed item back to its original path
+        :param trashed: TrashItem object
+        :raise: FileExistsError if there already is an item with the original path
+        :return: File or Folder object of the restored item
+        """
+        if os.path.lexists(trashed.path):
+            raise FileExistsError("{} exists".format(trashed.path))
+        os.makedirs(os.path.dirname(trashed.path), exist_ok=True)
+        os.rename(trashed.get_trashed_path(), trashed.path)
+        try:
+            os.remove(trashed.get_info_path())
+        except OSError:
+            pass
+        return stat_item(trashed.path)
+
+    def get_items(self):
+        """
+        :return: List of TrashItem objects in trash folders of all mounted devices
+        """
+        trash_dirs = set(self._dirs.values())
+        trash_dirs.add(Trash.HOME_TRASH)
+        uid = os.getuid() if hasattr(os, "getuid") else "user"
+        for part in psutil.disk_partitions():
+            trash_dirs.add(join(part.mountpoint, ".itu-trash-{}".format(uid)))
+        items = []
+        for trash_dir in trash_dirs:
+            try:
+                names = os.listdir(join(trash_dir, "files"))
+            except OSError:
+                continue
+            for name in names:
+                try:
+                    with open(join(trash_dir, "info", name + ".json"), encoding="utf-8") as f:
+                        info = json.load(f)
+                    items.append(TrashItem(trash_dir, name, info["path"], info["deleted"]))
+                except (OSError, ValueError, KeyError):
+                    items.append(TrashItem(trash_dir, name, None, 0))  # Info is lost, it can't be restored
+        return items
+
+    def purge(self, older_than=KEEP):
+        """
+        Removes trashed items in background
+        :param older_than: Only items trashed longer than this (seconds) are removed
+        """
+        with self._lock:
+            if self._purging:
+                return
+            self._purging = True
+        threading.Thread(target=self._purge, args=(older_than,), name="trash-purge", daemon=True).start()
+
+    def _purge(self, older_than):
+        try:
+            apply_background_priority()
+            limit = time.time() - older_than
+            for trashed in self.get_items():
+                if trashed.deleted > limit:
+                    continue
+                path = trashed.get_trashed_path()
+                try:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        TreeRemover().remove(path)
+                    else:
+                        os.remove(path)
+                    os.remove(trashed.get_info_path())
+                except OSError:
+                    pass
+        finally:
+            with self._lock:
+                self._purging = False
+
+
+class ActionFilter:
+    """
+    Evaluates action filter for many items at once
+    Native filters (see compile_predicate) are evaluated in process against cached stat info
+    For the shell form items are split into chunks and each chunk is checked by one shell script, which runs
+    the command for every item in a subshell and separates the outputs by marker lines
+    Results are cached by filter, path and modification time of the item
+    """
+
+    CHUNK = 256
+    WORKERS = 4
+    CACHE_SIZE = 100000
+
+    def __init__(self, workers=WORKERS, chunk=CHUNK, cache_size=CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()  # (filter, path, mtime) -> result
+        self._workers = workers
+        self._chunk = chunk
+        self._cache_size = cache_size
+
+    def check(self, a_filter, directory, items):
+        """
+        Same as check_action_filter for each of the items
+        :param a_filter: Action filter
+        :param directory: Directory in which should be commands executed
+        :param items: Items whose names are put instead of $!
+        :return: List of results in the order of the items
+        :raise: IncorrectActionFilterException if action filter has incorrect syntax
+        """
+        if is_predicate(a_filter):
+            predicate = compile_predicate(a_filter)
+            now = time.time()
+            return [predicate(i, now) for i in items]
+
+        command, success_out, comp = parse_action_filter(a_filter)
+        results = [None] * len(items)
+        keys = []
+        missing = []
+        with self._lock:
+            for n, item in enumerate(items):
+                try:
+                    key = (a_filter, item.get_path(), item.get_stat().st_mtime_ns)
+                except OSError:
+                    key = None  # Not cached, the item may not exist anymore
+                keys.append(key)
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    results[n] = self._cache[key]
+                else:
+                    missing.append(n)
+
+        chunks = [missing[i:i + self._chunk] for i in range(0, len(missing), self._chunk)]
+        outputs = run_parallel(lambda c: self._run_script(command, directory, [items[n].get_name() for n in c]),
+                               chunks, self._workers)
+
+        cacheable = []
+        for chunk, out in zip(chunks, outputs):
+            for n, out_txt in zip(chunk, out):
+                name = items[n].get_name()
+                if out_txt is None:  # Script did not get to this item (e.g. syntax error in the command)
+                    # Not cached, the failure may be temporary
+                    results[n] = check_action_filter(a_filter, directory, name)
+                else:
+                    results[n] = comp(out_txt, success_out.replace("$!", name))
+                    cacheable.append(n)
+        with self._lock:
+            for n in cacheable:
+                if keys[n] is not None:
+                    self._cache[keys[n]] = results[n]
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return results
+
+    def filter(self, a_filter, directory, items):
+        """
+        :return: Items for which the action filter succeeds
+        :raise: IncorrectActionFilterException if action filter has incorrect syntax
+        """
+        return [i for i, ok in zip(items, self.check(a_filter, directory, items)) if ok]
+
+    def _run_script(self, command, directory, names):
+        """
+        Runs the command for all names in one shell
+        :return: List of stripped outputs, None for names the script did not get to
+                 (all of them if the shell could not be started)
+        """
+        marker = "ITU-ACTION-FILTER-" + os.urandom(8).hex()
+        script = []
+        for n, name in enumerate(names):
+            script.append("printf '\\n%s\\n' '{}:{}'".format(marker, n))
+            # Own subshell, so cd or exit in the command does not affect other items
+            script.append("(\n{}\n) </dev/null 2>/dev/null".format(command.replace("$!", name)))
+        script.append("printf '\\n%s\\n' '{}:end'".format(marker))
+        try:
+            o = subprocess.Popen(["/bin/sh"], stdout=subprocess.PIPE, stdin=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, env={**os.environ}, cwd=directory)
+            out, err = o.communicate("\n".join(script).encode('utf-8'))
+        except Exception:
+            return [None] * len(names)
+
+        outputs = [None] * len(names)
+        for part in out.decode('utf-8', errors='replace').split("\n" + marker + ":")[1:]:
+            index, _, text = part.partition("\n")
+            if index.isdigit() and int(index) < len(names):
+                outputs[int(index)] = text.rstrip()
+        # Output of the last item is complete only if the script reached the end marker
+        last = max((n for n, o in enumerate(outputs) if o is not None), default=None)
+        if last is not None and not out.endswith((marker + ":end\n").encode('utf-8')):
+            outputs[last] = None
+        return outputs
 
 
 class FileManager:
 
+    cache = DirectoryCache()  # Shared by all file managers
+    folder_sizes = FolderSizes()
+    transfers = TransferQueue()
+    trash = Trash()
+    action_filter = ActionFilter()
+    disks = DiskRegistry()
+    disk_usage = DiskUsageMonitor()
+
     def __init__(self, root_dir="/"):
         self._root = Folder(root_dir)
         self.active = Folder(root_dir)
@@ -350,7 +3045,7 @@ class FileManager:
         self.active = dir
 
     def get_disks(self):
-        return [Disk(d) for d in psutil.disk_partitions()]
+        return FileManager.disks.get_disks()
 
     def set_root(self, root_dir):
         self._root = Folder(root_dir)
@@ -362,6 +3057,31 @@ class FileManager:
         return getpass.getuser() + "@" + gethostname() + ":" + "/" + self.active.get_name() + "$"
 
 
+def signal_process_tree(pid, sig, include_parent=True):
+    """
+    Sends signal to a process and all its descendants, so pipelines started by a shell get it too
+    :param pid: Process id
+    :param sig: Signal number, e.g. signal.SIGINT
+    :param include_parent: If false only the descendants get the signal
+    :return: Number of processes which got the signal
+    """
+    try:
+        parent = psutil.Process(pid)
+        processes = parent.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    if include_parent:
+        processes.append(parent)
+    sent = 0
+    for p in processes:
+        try:
+            p.send_signal(sig)
+            sent += 1
+        except psutil.NoSuchProcess:
+            pass
+    return sent
+
+
 def make_shell_command(command, directory):
     """
     Runs a command in a subshell and returns output
@@ -379,6 +3099,190 @@ def make_shell_command(command, directory):
         return None, "ERROR::ITU-BACKEND: Could not run subprocess"
 
 
+def parse_action_filter(a_filter):
+    """
+    Splits action filter into the command, expected output and comparison
+    :param a_filter: Action filter
+    :return: tuple (command, success_out, comp)
+    :raise: IncorrectActionFilterException if action filter has incorrect syntax
+    """
+    # Get operator
+    splitted = a_filter.split(" == ", 1)
+    if len(splitted) == 2:
+        return splitted[0], splitted[1], (lambda a, b: a == b)
+    splitted = a_filter.split(" != ", 1)
+    if len(splitted) == 2:
+        return splitted[0], splitted[1], (lambda a, b: a != b)
+    raise IncorrectActionFilterException("No comparison sign found")
+
+
+# Native action filter, e.g. size > 10MB and name ~ "*.log" and mtime < 7d
+PREDICATE_TOKEN = re.compile(r'''\s*(?:(\(|\))|(==|!=|<=|>=|!~|<|>|~)|"((?:[^"\\]|\\.)*)"|'([^']*)'|([^\s()<>=!~"']+))''')
+PREDICATE_OPERATORS = {
+    "==": (lambda a, b: a == b),
+    "!=": (lambda a, b: a != b),
+    "<": (lambda a, b: a < b),
+    "<=": (lambda a, b: a <= b),
+    ">": (lambda a, b: a > b),
+    ">=": (lambda a, b: a >= b),
+    "~": (lambda a, b: b.match(a) is not None),  # Glob pattern compiled to regex
+    "!~": (lambda a, b: b.match(a) is None),
+}
+DURATIONS = {"s": 1, "m": 60, "min": 60, "h": 60 * 60, "d": 24 * 60 * 60, "w": 7 * 24 * 60 * 60,
+             "y": 365 * 24 * 60 * 60}
+
+
+def _item_type(item):
+    if item._entry is not None and item._entry.is_symlink() or item._entry is None and os.path.islink(item.get_path()):
+        return "link"
+    return "folder" if item.is_folder() else "file"
+
+
+def _parse_size(value):
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([kmgt]?b?)", value.lower())
+    if m is None:
+        raise IncorrectActionFilterException("Incorrect size: " + value)
+    unit = m.group(2).upper()
+    return float(m.group(1)) * get_divisor(unit if unit.endswith("B") else unit + "B")
+
+
+def _parse_duration(value):
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([a-z]*)", value.lower())
+    if m is None or m.group(2) not in DURATIONS and m.group(2) != "":
+        raise IncorrectActionFilterException("Incorrect duration: " + value)
+    return float(m.group(1)) * DURATIONS.get(m.group(2), 1)
+
+
+def _parse_type(value):
+    value = {"dir": "folder", "f": "file", "d": "folder", "l": "link"}.get(value, value)
+    if value not in ("file", "folder", "link"):
+        raise IncorrectActionFilterException("Incorrect type: " + value)
+    return value
+
+
+# Field -> (getter of the value from item and current time, parser of the value, allowed operators)
+PREDICATE_FIELDS = {
+    "name": (lambda i, now: i.get_name(), str, ("==", "!=", "~", "!~")),
+    "ext": (lambda i, now: os.path.splitext(i.get_name())[1][1:].lower(), str.lower, ("==", "!=", "~", "!~")),
+    "path": (lambda i, now: i.get_path(), str, ("==", "!=", "~", "!~")),
+    "size": (lambda i, now: i.get_stat().st_size, _parse_size, ("==", "!=", "<", "<=", ">", ">=")),
+    # Age of the item, mtime < 7d is true for items modified in the last 7 days
+    "mtime": (lambda i, now: now - i.get_stat().st_mtime, _parse_duration, ("<", "<=", ">", ">=")),
+    "type": (lambda i, now: _item_type(i), _parse_type, ("==", "!=")),
+}
+
+
+def is_predicate(a_filter):
+    """
+    :return: True if the action filter is written in the native language instead of the shell form
+    """
+    # First comparison has to be a field directly followed by an operator, so shell commands
+    # like type -t ls == builtin keep working
+    m = re.match(r"[\s(]*(?:not[\s(]+)*(\w+)\s*(==|!=|<=|>=|!~|<|>|~)", a_filter)
+    return m is not None and m.group(1) in PREDICATE_FIELDS
+
+
+@functools.lru_cache(maxsize=64)
+def compile_predicate(a_filter):
+    """
+    Compiles native action filter into a function evaluated without any subprocess
+    Comparisons field operator value can be combined by and, or, not and parentheses
+    Fields are name, ext, path (==, != and glob matching ~, !~), size (with B, KB, MB, GB or TB),
+    mtime (age with s, m, h, d, w or y) and type (file, folder or link)
+    :param a_filter: Action filter, e.g. size > 10MB and name ~ "*.log" and mtime < 7d
+    :return: Function taking item and current time and returning if the filter succeeds
+    :raise: IncorrectActionFilterException if action filter has incorrect syntax
+    """
+    tokens = []
+    pos = 0
+    while pos < len(a_filter.rstrip()):
+        m = PREDICATE_TOKEN.match(a_filter, pos)
+        if m is None:
+            raise IncorrectActionFilterException("Unexpected character: " + a_filter[pos:].strip())
+        if m.group(1) is not None:
+            tokens.append(("paren", m.group(1)))
+        elif m.group(2) is not None:
+            tokens.append(("op", m.group(2)))
+        elif m.group(3) is not None:
+            tokens.append(("value", re.sub(r"\\(.)", r"\1", m.group(3))))
+        elif m.group(4) is not None:
+            tokens.append(("value", m.group(4)))
+        else:
+            tokens.append(("word", m.group(5)))
+        pos = m.end()
+    tokens.append(("end", None))
+    parser = _PredicateParser(tokens)
+    predicate = parser.parse_or()
+    if parser.peek() != ("end", None):
+        raise IncorrectActionFilterException("Unexpected " + str(parser.peek()[1]))
+    return predicate
+
+
+class _PredicateParser:
+    """
+    Recursive descent parser of native action filters, or has lower precedence than and
+    """
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._pos = 0
+
+    def peek(self):
+        return self._tokens[self._pos]
+
+    def next(self):
+        token = self._tokens[self._pos]
+        if token[0] == "end":
+            raise IncorrectActionFilterException("Unexpected end of filter")
+        self._pos += 1
+        return token
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == ("word", "or"):
+            self.next()
+            operands.append(self.parse_and())
+        return functools.reduce(lambda a, b: (lambda i, now: a(i, now) or b(i, now)), operands)
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.peek() == ("word", "and"):
+            self.next()
+            operands.append(self.parse_not())
+        return functools.reduce(lambda a, b: (lambda i, now: a(i, now) and b(i, now)), operands)
+
+    def parse_not(self):
+        token = self.next()
+        if token == ("word", "not"):
+            operand = self.parse_not()
+            return lambda i, now: not operand(i, now)
+        if token == ("paren", "("):
+            operand = self.parse_or()
+            if self.next() != ("paren", ")"):
+                raise IncorrectActionFilterException("Missing )")
+            return operand
+        if token[0] != "word" or token[1] not in PREDICATE_FIELDS:
+            raise IncorrectActionFilterException("Unknown field " + str(token[1]))
+        getter, parse, operators = PREDICATE_FIELDS[token[1]]
+        op = self.next()
+        if op[0] != "op" or op[1] not in operators:
+            raise IncorrectActionFilterException("Operator {} cannot be used with {}".format(op[1], token[1]))
+        value = self.next()
+        if value[0] not in ("word", "value"):
+            raise IncorrectActionFilterException("Missing value after " + op[1])
+        value = parse(value[1])
+        if op[1] in ("~", "!~"):
+            value = re.compile(fnmatch.translate(value))
+        comp = PREDICATE_OPERATORS[op[1]]
+
+        def compare(i, now):
+            try:
+                return comp(getter(i, now), value)
+            except OSError:  # Item does not exist anymore or is a broken link
+                return False
+        return compare
+
+
 def check_action_filter(a_filter, directory, file=""):
     """
     Executes command in a subshell and checks it's output with passed in successful one
@@ -389,20 +3293,7 @@ def check_action_filter(a_filter, directory, file=""):
     :return: True if command had the same output as success_out
     :raise: IncorrectActionFilterException if action filter has incorrect syntax
     """
-    # Get operator
-    splitted = a_filter.split(" == ", 1)
-    if len(splitted) == 2:
-        command = splitted[0]
-        success_out = splitted[1]
-        comp = (lambda a, b: a == b)
-    else:
-        splitted = a_filter.split(" != ", 1)
-        if len(splitted) == 2:
-            command = splitted[0]
-            success_out = splitted[1]
-            comp = (lambda a, b: a != b)
-        else:
-            raise IncorrectActionFilterException("No comparison sign found")
+    command, success_out, comp = parse_action_filter(a_filter)
 
     # Replace $! with file name
     command = command.replace("$!", file)
@@ -421,6 +3312,14 @@ def check_action_filter(a_filter, directory, file=""):
 class IncorrectActionFilterException(Exception):
     ...
 
+
+class OperationCancelledException(Exception):
+    ...
+
+
+class VerificationFailedException(Exception):
+    ...
+
 if __name__ == "__main__":
     fm = FileManager()
     fm.set_root("/")
@@ -428,7 +3327,8 @@ if __name__ == "__main__":
 
     print("Disks:")
     for c, a in enumerate(fm.get_disks()):
-        print(str(c)+"\t"+a.get_name()+"\t: "+a.get_path()+" ("+str(round(a.get_free_space("GB"), 1))+"/"+str(round(a.get_capacity("GB"), 1))+" GB)")
+        u = a.get_usage()
+        print(str(c)+"\t"+a.get_name()+"\t: "+a.get_path()+" ("+str(round(u.get_free_space("GB"), 1))+"/"+str(round(u.get_capacity("GB"), 1))+" GB)")
 
     while True:
         cmdall = input("> ")
@@ -520,6 +3420,29 @@ if __name__ == "__main__":
             if os.path.isfile(join(fldr.get_path(), cmd[1])):
                 f = File(join(fldr.get_path(), cmd[1]))
                 print(datetime.utcfromtimestamp(f.get_modification_time()).strftime('%Y-%m-%d %H:%M:%S'))
+        elif cmd[0] == "bench":  # Compares copying of a folder or a file with shutil
+            src = join(fldr.get_path(), cmd[1])
+            dst = join(join(fldr.get_path(), cmd[2]), ".itu-bench")
+            rounds = int(cmd[3]) if len(cmd) > 3 else 3
+            if os.path.isdir(src):
+                methods = [("copytree", lambda s, d: shutil.copytree(s, d)),
+                           ("TreeCopier", lambda s, d: TreeCopier().copy(s, d))]
+            else:
+                methods = [("copyfile", lambda s, d: shutil.copyfile(s, d)),
+                           ("sequential", lambda s, d: copy_file(s, d, workers=1)),
+                           ("parallel", lambda s, d: copy_file(s, d))]
+            best = {}
+            for _ in range(rounds):
+                for name, method in methods:
+                    start = time.perf_counter()
+                    method(src, dst)
+                    best[name] = min(best.get(name, float("inf")), time.perf_counter() - start)
+                    if os.path.isdir(dst):
+                        shutil.rmtree(dst)
+                    else:
+                        os.remove(dst)
+            for name, _ in methods:
+                print(name + ":\t" + str(round(best[name], 3)) + " s")
         elif cmd[0] == "items":
             if os.path.isdir(join(fldr.get_path(), cmd[1])):
                 f = Folder(join(fldr.get_path(), cmd[1]))
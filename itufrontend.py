@@ -8,46 +8,187 @@ from PyQt5 import QtCore
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import (QMainWindow, QApplication, QDesktopWidget,
                              QSplitter, QFrame, QHBoxLayout, QPushButton,
-                             QTextEdit, QWidget, QVBoxLayout, QSizePolicy,
+                             QPlainTextEdit, QWidget, QVBoxLayout, QSizePolicy,
                              QLineEdit, QLabel, QFontDialog, QTableWidget,
                              QTableWidgetItem, QComboBox, QAction,
                              QFormLayout, QGroupBox, QAbstractItemView,
-                             QSpinBox, QInputDialog, QMessageBox, QSpacerItem)
+                             QSpinBox, QInputDialog, QMessageBox, QSpacerItem,
+                             QCheckBox, QShortcut)
 from PyQt5.QtCore import Qt
 from PyQt5 import QtGui
-from PyQt5.QtGui import QIcon, QStandardItemModel, QFont
+from PyQt5.QtGui import QIcon, QFont
 import sys
 from datetime import datetime
 import re
 import json
+import functools
+import sqlite3
+import os
+import shlex
+import signal
+import codecs
+import collections
 
 
-class ExplorerModel(QtGui.QStandardItemModel):
+class ExplorerModel(QtCore.QAbstractTableModel):
+    """
+    Table model backed directly by the list of displayed items,
+    cells are formatted only when the view asks for them
+    """
 
     MIME_FORMAT = "application/x-qabstractitemmodeldatalist"
 
-    def __init__(self, parent):
+    folder_size_ready = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent, language):
         super(ExplorerModel, self).__init__()
         self.parent = parent
+        self.language = language
+        self.items = []
+        self.show_paths = False  # Names are shown with whole paths (disk search results)
+
+    def set_items(self, items):
+        """
+        Replaces displayed items
+        :param items: list of Files and Folders, the first row ("..") is not included
+        """
+        self.beginResetModel()
+        self.items = items
+        self.endResetModel()
+
+    def append_items(self, items):
+        """
+        Adds items at the end of the table
+        :param items: list of Files and Folders
+        """
+        if len(items) == 0:
+            return
+        first = len(self.items) + 1
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(items) - 1)
+        self.items.extend(items)
+        self.endInsertRows()
+
+    def insert_item(self, row, item):
+        """
+        :param row: Index in items at which the item is inserted
+        """
+        self.beginInsertRows(QtCore.QModelIndex(), row + 1, row + 1)
+        self.items.insert(row, item)
+        self.endInsertRows()
+
+    def remove_item(self, row):
+        """
+        :param row: Index in items of the removed item
+        """
+        self.beginRemoveRows(QtCore.QModelIndex(), row + 1, row + 1)
+        del self.items[row]
+        self.endRemoveRows()
+
+    def replace_item(self, row, item):
+        """
+        :param row: Index in items of the replaced item
+        """
+        self.items[row] = item
+        self.dataChanged.emit(self.index(row + 1, 0), self.index(row + 1, self.columnCount() - 1))
+
+    def sort_items(self, key, reverse):
+        """
+        Sorts items in place, selection is kept
+        """
+        self.layoutAboutToBeChanged.emit()
+        persistent = [(i, self.items[i.row()-1]) for i in self.persistentIndexList() if i.row() > 0]
+        self.items.sort(key=key, reverse=reverse)
+        rows = {id(i): r + 1 for r, i in enumerate(self.items)}
+        for index, item in persistent:
+            self.changePersistentIndex(index, self.index(rows[id(item)], index.column()))
+        self.layoutChanged.emit()
+
+    def refresh_column(self, column):
+        """
+        Makes the view repaint the column (only visible cells are repainted)
+        """
+        if len(self.items) > 0:
+            self.dataChanged.emit(self.index(1, column), self.index(len(self.items), column))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.items) + 1  # First row is the parent folder
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return FileExplorerWidget.FILES_WINDOW_COLUMNS
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role not in (Qt.DisplayRole, Qt.ToolTipRole) or not index.isValid():
+            return None
+        if index.row() == 0:
+            return ".." if index.column() == 0 and role == Qt.DisplayRole else None
+        i = self.items[index.row()-1]
+        if index.column() == 0:
+            return i.get_path() if self.show_paths else i.get_name()
+        if i.is_folder():
+            if index.column() != 1:
+                return None if role == Qt.ToolTipRole else ""
+            size = self.get_folder_size(i)
+            if size is None or size[0] is None:  # Not computed yet or failed
+                return None if role == Qt.ToolTipRole else ""
+            if role == Qt.ToolTipRole:
+                return str(size[1]) + " " + MainWindow.NAMES[self.language]["items"]
+            s, met = itubackend.auto_metric(size[0])
+            return str(round(s, 1)) + " " + met
+        if role == Qt.ToolTipRole:
+            return None
+        try:
+            if index.column() == 1:
+                s, met = i.get_size(metric_auto=True)
+                return str(round(s, 1)) + " " + met
+            return datetime.utcfromtimestamp(i.get_modification_time()).strftime('%d/%m/%Y %H:%M:%S')
+        except OSError:  # File was removed or is a broken link
+            return ""
+
+    def get_folder_size(self, folder):
+        """
+        :return: tuple (size, item count) or None if it is being computed,
+                 folder_size_ready is emitted once it is done
+        """
+        return itubackend.FileManager.folder_sizes.get(folder, self.folder_size_ready.emit)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return MainWindow.NAMES[self.language]["files_header"][section]
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled
+        if index.row() == 0:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+
+    def mimeTypes(self):
+        return [ExplorerModel.MIME_FORMAT]
+
+    def supportedDropActions(self):
+        return Qt.CopyAction | Qt.MoveAction
 
     # Inspired by http://apocalyptech.com/linux/qt/qtableview/
     def dropMimeData(self, data, action, row, col, parent):
         """
         Drop method
         """
-        if data.hasFormat(ExplorerModel.MIME_FORMAT):
-            source_item = QtGui.QStandardItemModel()
-            source_item.dropMimeData(data, QtCore.Qt.CopyAction, 0, 0, QtCore.QModelIndex())
-
-            if MainWindow.ACTIVE_EXPLORER.fm.active.get_path() == self.parent.parent.fm.active.get_path():
-                return False
+        if not data.hasFormat(ExplorerModel.MIME_FORMAT):
+            return False
 
-            if self.parent.parent.parent.alt_pressed:
-                self.parent.parent.parent.move_to(self.parent.parent.fm)
-            else:
-                self.parent.parent.parent.copy_to(self.parent.parent.fm)
+        if MainWindow.ACTIVE_EXPLORER.fm.active.get_path() == self.parent.parent.fm.active.get_path():
+            return False
 
-        return super().dropMimeData(data, action, row, 0, parent)
+        if self.parent.parent.parent.alt_pressed:
+            self.parent.parent.parent.move_to(to_fm=self.parent.parent.fm)
+        else:
+            self.parent.parent.parent.copy_to(to_fm=self.parent.parent.fm)
+        return True
 
 
 class ExplorerStyle(QtWidgets.QProxyStyle):
@@ -89,43 +230,17 @@ class ExplorerTableView(QtWidgets.QTableView):
         self.setStyle(ExplorerStyle(self))
         self.doubleClicked.connect(self.double_clicked)
         self.clicked.connect(self.was_clicked)
-        self.model = ExplorerModel(self)
-        self.model.setHorizontalHeaderLabels(MainWindow.NAMES[self.language]["files_header"])
+        self.model = ExplorerModel(self, self.language)
+        self.model.folder_size_ready.connect(self.parent.folder_size_ready)
         self.setModel(self.model)
         selectionModel = self.selectionModel()
         selectionModel.selectionChanged.connect(self.parent.parent.update_explorer_focus)
 
     def update(self, files, dont_hide=False):
-        self.model.removeRows(0, self.model.rowCount())
-        name = QtGui.QStandardItem("..")
-        name.setEditable(False)
-        name.setDropEnabled(False)
-        name.setDragEnabled(False)
-        size = QtGui.QStandardItem("")
-        size.setDragEnabled(False)
-        changed = QtGui.QStandardItem("")
-        changed.setDragEnabled(False)
-        self.model.appendRow([name, size, changed])
-
-        for c, i in enumerate(files):
-            name = QtGui.QStandardItem(i.get_name())
-            name.setEditable(False)
-            name.setDropEnabled(False)
-
-            if not i.is_folder():
-                s, met = i.get_size(metric_auto=True)
-                size = QtGui.QStandardItem(str(round(s, 1)) + " " + met)
-                changed = QtGui.QStandardItem(datetime.utcfromtimestamp(i.get_modification_time()).strftime('%d/%m/%Y %H:%M:%S'))
-            else:
-                size = QtGui.QStandardItem("")
-                changed = QtGui.QStandardItem("")
+        self.model.set_items(files)
 
-            changed.setEditable(False)
-            changed.setDropEnabled(False)
-            size.setEditable(False)
-            size.setDropEnabled(False)
-
-            self.model.appendRow([name, size, changed])
+    def append(self, files):
+        self.model.append_items(files)
 
     def header_clicked(self, i):
         if self.parent.sort_by == i:
@@ -133,17 +248,20 @@ class ExplorerTableView(QtWidgets.QTableView):
         else:
             self.parent.sort_by = i
             self.parent.sort_desc = False
-        self.parent.update()
+        self.parent.refresh_view()
 
     def double_clicked(self, index):
-        if index.row() == 0:
+        selected = self.parent.displayed[index.row()-1] if index.row() > 0 else None
+        if self.parent.searching_disk():  # Leave disk search results
+            self.parent.search_disk.setChecked(False)
+            self.parent.search.setText("")
+            self.parent.apply_search()
+        if selected is None:
             self.parent.fm.set_active(self.parent.fm.active.get_parent())
+        elif selected.is_folder():
+            self.parent.fm.set_active(selected)
         else:
-            selected = self.parent.displayed[index.row()-1]
-            if selected.is_folder():
-                self.parent.fm.set_active(selected)
-            else:
-                selected.open()
+            selected.open()
         self.parent.update()
 
     def was_clicked(self, index):
@@ -166,6 +284,303 @@ class ExplorerTableView(QtWidgets.QTableView):
         return rsec
 
 
+class ListingWorker(QtCore.QThread):
+    """
+    Lists a folder in a background thread and sends its items in batches
+    """
+
+    BATCH_SIZE = 500
+    RUNNING = set()  # Keeps workers alive until their thread finishes
+
+    batch_ready = QtCore.pyqtSignal(int, object)
+    listing_done = QtCore.pyqtSignal(int, object)
+    listing_failed = QtCore.pyqtSignal(int, str)
+
+    def __init__(self, folder, generation):
+        """
+        :param folder: Folder to be listed
+        :param generation: Number identifying this listing in signals
+        """
+        super(ListingWorker, self).__init__()
+        self.folder = folder
+        self.generation = generation
+        self.cancelled = False
+        ListingWorker.RUNNING.add(self)
+        self.finished.connect(self.forget)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def forget(self):
+        ListingWorker.RUNNING.discard(self)
+
+    def run(self):
+        try:
+            version, content = itubackend.FileManager.cache.listing(self.folder, ListingWorker.BATCH_SIZE)
+            for batch in content:
+                if self.cancelled:
+                    return
+                self.batch_ready.emit(self.generation, batch)
+        except Exception as e:
+            if not self.cancelled:
+                self.listing_failed.emit(self.generation, str(e))
+            return
+        if not self.cancelled:
+            self.listing_done.emit(self.generation, version)
+
+
+class DiskSearchWorker(QtCore.QThread):
+    """
+    Queries the disk's filename index in background
+    """
+
+    RUNNING = set()  # Keeps workers alive until their thread finishes
+
+    search_done = QtCore.pyqtSignal(int, object, bool)  # generation, results, index is still being built
+    search_failed = QtCore.pyqtSignal(int, str)
+
+    def __init__(self, index, text, generation, built):
+        """
+        :param index: FilenameIndex of the disk
+        :param text: Searched text
+        :param generation: Number identifying this search in signals
+        :param built: Called from other thread once the index, which is being built, is finished
+        """
+        super(DiskSearchWorker, self).__init__()
+        self.index = index
+        self.text = text
+        self.generation = generation
+        self.built = built
+        DiskSearchWorker.RUNNING.add(self)
+        self.finished.connect(self.forget)
+
+    def forget(self):
+        DiskSearchWorker.RUNNING.discard(self)
+
+    def run(self):
+        try:
+            results = self.index.query(self.text, built=self.built)
+        except (OSError, sqlite3.Error) as e:
+            self.search_failed.emit(self.generation, str(e))
+            return
+        self.search_done.emit(self.generation, results, self.index.is_building())
+
+
+class ShellRunner(QtCore.QObject):
+    """
+    Runs commands of one panel asynchronously and streams their output (stdout and stderr merged)
+    With persistent shell all commands run in one /bin/sh, so cd and exported variables persist,
+    end of each command is recognized by a marker line with its exit code and working directory
+    """
+
+    output = QtCore.pyqtSignal(str)
+    command_done = QtCore.pyqtSignal(int, str)  # exit code, new working directory if the command changed it or ""
+
+    def __init__(self, persistent, parent):
+        super(ShellRunner, self).__init__(parent)
+        self.persistent = persistent
+        self.process = None
+        self.running = False
+        self.shell_dir = None
+        self.directory = None
+        self.marker = ("\nITU-COMMAND-DONE-" + os.urandom(8).hex() + ":").encode()
+        self.pending = b""
+        self.decoder = None
+
+    def run(self, command, directory):
+        """
+        Starts command, output is emitted as it comes
+        :param command: Shell command
+        :param directory: Directory in which should be the command executed
+        :return: False if some command is still running
+        """
+        if self.running:
+            return False
+        self.running = True
+        self.directory = directory
+        self.pending = b""
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        if not self.persistent:
+            self.process = self.new_process()
+            self.process.setWorkingDirectory(directory)
+            self.process.start("/bin/sh", ["-c", command])
+            self.process.closeWriteChannel()  # Commands get empty input
+            return True
+
+        if self.process is None:
+            self.process = self.new_process()
+            self.process.setWorkingDirectory(directory)
+            self.process.start("/bin/sh", [])
+            self.shell_dir = directory
+        script = ""
+        if self.shell_dir != directory:  # Panel was switched to other folder
+            script += "cd -- {}\n".format(shlex.quote(directory))
+        # Commands must not read following commands from shell's input
+        script += "{{ {}\n}} </dev/null\nprintf '{}%s:%s\\n' \"$?\" \"$PWD\"\n".format(
+            command, self.marker.decode().replace("\n", "\\n"))
+        self.process.write(script.encode("utf-8"))
+        return True
+
+    def new_process(self):
+        process = QtCore.QProcess(self)
+        process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
+        process.readyReadStandardOutput.connect(self.read_output)
+        process.finished.connect(functools.partial(self.process_finished, process))
+        process.errorOccurred.connect(functools.partial(self.process_error, process))
+        return process
+
+    def read_output(self):
+        self.pending += bytes(self.process.readAllStandardOutput())
+        if not self.persistent:
+            self.emit_output(self.pending)
+            self.pending = b""
+            return
+        start = self.pending.find(self.marker)
+        if start != -1:
+            self.emit_output(self.pending[:start])
+            self.pending = self.pending[start:]
+            end = self.pending.find(b"\n", len(self.marker))
+            if end != -1:
+                code, _, directory = self.pending[len(self.marker):end].decode("utf-8", "replace").partition(":")
+                self.pending = b""
+                self.shell_dir = directory
+                self.running = False
+                self.command_done.emit(int(code) if code.isdigit() else -1,
+                                       directory if directory != self.directory else "")
+            return
+        # End of the output is held back only if it can be the beginning of the marker
+        cut = self.pending.rfind(b"\n")
+        if cut == -1 or not self.marker.startswith(self.pending[cut:]):
+            cut = len(self.pending)
+        self.emit_output(self.pending[:cut])
+        self.pending = self.pending[cut:]
+
+    def emit_output(self, data):
+        text = self.decoder.decode(data)
+        if len(text) > 0:
+            self.output.emit(text)
+
+    def process_finished(self, process, code, status):
+        if process is not self.process:
+            return
+        self.read_output()
+        self.emit_output(self.pending)
+        self.process = None
+        if self.running:  # Command or the persistent shell itself ended
+            self.running = False
+            self.command_done.emit(code if status == QtCore.QProcess.NormalExit else -1, "")
+
+    def process_error(self, process, error):
+        if error == QtCore.QProcess.FailedToStart and process is self.process:
+            self.output.emit("ERROR::ITU-FRONTEND: Could not run subprocess\n")
+            self.process = None
+            self.running = False
+            self.command_done.emit(-1, "")
+
+    def interrupt(self):
+        """
+        Sends SIGINT to the running command and everything it started (as Ctrl-C in a terminal)
+        """
+        if self.running and self.process is not None:
+            itubackend.signal_process_tree(int(self.process.processId()), signal.SIGINT,
+                                           include_parent=not self.persistent)
+
+    def kill(self):
+        """
+        Kills the running command, the persistent shell is killed too and started again with the next command
+        """
+        if self.running and self.process is not None:
+            itubackend.signal_process_tree(int(self.process.processId()), signal.SIGKILL)
+
+
+class CommandLine(QLineEdit):
+    """
+    Line for terminal commands, Ctrl+C without selected text interrupts the running command
+    and Ctrl+\\ kills it
+    """
+
+    interrupt_pressed = QtCore.pyqtSignal()
+    kill_pressed = QtCore.pyqtSignal()
+
+    def keyPressEvent(self, event):
+        if event.modifiers() & Qt.ControlModifier:
+            if event.key() == Qt.Key_C and not self.hasSelectedText():
+                self.interrupt_pressed.emit()
+                return
+            if event.key() == Qt.Key_Backslash:
+                self.kill_pressed.emit()
+                return
+        super(CommandLine, self).keyPressEvent(event)
+
+
+class Console(QPlainTextEdit):
+    """
+    Read only terminal output with limited scrollback
+    Appended text is buffered in a bounded deque of lines and added to the end of the document
+    by a timer, so huge outputs neither relayout the whole history nor grow memory without limit
+    """
+
+    FLUSH_INTERVAL = 50  # ms
+    MAX_LINE_LENGTH = 4096  # Longer lines are wrapped into more lines
+
+    def __init__(self, scrollback, parent):
+        super(Console, self).__init__(parent)
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.scrollback = scrollback
+        self.setMaximumBlockCount(scrollback)
+        # Text not shown yet, lines are joined by newlines, first one continues the last shown line
+        self.pending = collections.deque([""], maxlen=scrollback)
+        self.dropped = False
+        self.flush_timer = QtCore.QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(Console.FLUSH_INTERVAL)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def set_scrollback(self, scrollback):
+        """
+        :param scrollback: Maximum number of kept lines
+        """
+        self.flush()
+        self.scrollback = scrollback
+        self.setMaximumBlockCount(scrollback)
+        self.pending = collections.deque([""], maxlen=scrollback)
+
+    def append_text(self, text):
+        # Only the lines which can be kept are split out of the text
+        lines = text.rsplit("\n", self.scrollback)
+        if len(lines) > self.scrollback:
+            del lines[0]
+            self.pending.clear()
+            self.dropped = True
+        else:
+            lines[0] = self.pending.pop() + lines[0]
+        if max(map(len, lines)) > Console.MAX_LINE_LENGTH:
+            lines = [line[i:i + Console.MAX_LINE_LENGTH] for line in lines
+                     for i in range(0, max(len(line), 1), Console.MAX_LINE_LENGTH)]
+        if len(self.pending) + len(lines) > self.scrollback:
+            self.dropped = True  # Oldest lines are dropped before being shown
+        self.pending.extend(lines)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        if len(self.pending) == 1 and self.pending[0] == "":
+            return
+        text = "\n".join(self.pending)
+        if self.dropped:  # First pending line is not a continuation of the last shown one anymore
+            text = "\n" + text
+        self.pending = collections.deque([""], maxlen=self.scrollback)
+        self.dropped = False
+        bar = self.verticalScrollBar()
+        at_end = bar.value() == bar.maximum()
+        cursor = QtGui.QTextCursor(self.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.insertText(text)
+        if at_end:
+            bar.setValue(bar.maximum())
+
+
 class ComboBox(QtWidgets.QComboBox):
     popupAboutToBeShown = QtCore.pyqtSignal()
 
@@ -175,12 +590,13 @@ class ComboBox(QtWidgets.QComboBox):
 
     def showPopup(self):
         self.popupAboutToBeShown.emit()
-        self.parent.update()
         super(ComboBox, self).showPopup()
 
 
 class FileExplorerWidget(QSplitter):
 
+    index_ready = QtCore.pyqtSignal(str)  # Emitted from other thread once a disk index is built
+
     CMD_IN_MAX_HEIGHT = 25
     CMD_OUT_MAX_HEIGHT = 2 * CMD_IN_MAX_HEIGHT
     FILES_WINDOW_COLUMNS = 3
@@ -190,6 +606,12 @@ class FileExplorerWidget(QSplitter):
     SORT_SIZE = 1
     SORT_CHANGED = 2
 
+    MAX_ROW_UPDATES = 1000  # More changes than this rebuild the whole view
+    SEARCH_DELAY = 100  # ms
+    RESORT_DELAY = 300  # ms, computed folder sizes are shown at most this often
+    FREE_SPACE_INTERVAL = 1000  # ms, the usage itself is refreshed by FileManager.disk_usage
+    SEARCH_SPECIAL = set("\\[](){}|?+^$")  # Characters after which the search cannot just narrow results
+
     def __init__(self, fm, language, parent):
         super(FileExplorerWidget, self).__init__(Qt.Vertical)
         self.language = language
@@ -198,6 +620,25 @@ class FileExplorerWidget(QSplitter):
         self.sort_desc = False
         self.fm = fm
         self.curr_disk = 0
+        self.listing = {}
+        self.new_listing = {}
+        self.keep_rows = False
+        self.displayed = []
+        self.worker = None
+        self.listing_generation = 0
+        self.search_generation = 0
+        self.index_ready.connect(self.index_built)
+        self.listing_version = None
+        self.listed_path = None
+        self.changes_pending = False
+        self.sorted_listing = None
+        self.filter_text = ""
+        self.filter_disk = False
+        self.disk_list = None
+        self.disks_version = None
+        self.shell = ShellRunner(MainWindow.PERSISTENT_SHELL, self)
+        self.shell.output.connect(self.append_output)
+        self.shell.command_done.connect(self.command_done)
         self.reinit()
 
     def reinit(self):
@@ -219,19 +660,26 @@ class FileExplorerWidget(QSplitter):
 
         # Search field
         self.search = QLineEdit(self.topf)
+        self.search_disk = QCheckBox(MainWindow.NAMES[self.language]["search_disk"], self.topf)
+
+        # Free space of the selected disk, measured in background
+        self.free_space = QLabel(self.topf)
 
         self.topf_layout.addWidget(self.disks)
+        self.topf_layout.addWidget(self.free_space)
         self.topf_layout.addWidget(self.search)
+        self.topf_layout.addWidget(self.search_disk)
 
         self.files = ExplorerTableView(self, self.language)
 
         # Left window terminal
-        self.cmd_in = QLineEdit(self.files)
+        self.cmd_in = CommandLine(self.files)
         self.cmd_in.setMaximumHeight(FileExplorerWidget.CMD_IN_MAX_HEIGHT)
         self.cmd_in.returnPressed.connect(self.cmd_in_entered)
-        self.cmd_out = QTextEdit(self.files)
+        self.cmd_in.interrupt_pressed.connect(self.shell.interrupt)
+        self.cmd_in.kill_pressed.connect(self.shell.kill)
+        self.cmd_out = Console(MainWindow.CONSOLE_SCROLLBACK, self.files)
         self.cmd_out.setMaximumHeight(FileExplorerWidget.CMD_OUT_MAX_HEIGHT)
-        self.cmd_out.setReadOnly(True)
 
         # Combo box for disk selection
         self.addWidget(self.topf)
@@ -239,7 +687,25 @@ class FileExplorerWidget(QSplitter):
         self.addWidget(self.cmd_out)
         self.addWidget(self.cmd_in)
 
-        self.search.textChanged.connect(self.update)
+        # Search is applied once the user stops typing
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(FileExplorerWidget.SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.apply_search)
+        self.search.textChanged.connect(self.search_timer.start)
+        self.search_disk.toggled.connect(self.search_timer.start)
+
+        self.resort_timer = QtCore.QTimer(self)
+        self.resort_timer.setSingleShot(True)
+        self.resort_timer.setInterval(FileExplorerWidget.RESORT_DELAY)
+        self.resort_timer.timeout.connect(self.resort)
+        self.filter_text = self.search.text()
+        self.filter_disk = self.search_disk.isChecked()
+
+        self.free_space_timer = QtCore.QTimer(self)
+        self.free_space_timer.setInterval(FileExplorerWidget.FREE_SPACE_INTERVAL)
+        self.free_space_timer.timeout.connect(self.update_free_space)
+        self.free_space_timer.start()
 
         self.update()
 
@@ -248,61 +714,497 @@ class FileExplorerWidget(QSplitter):
         self.search.setPlaceholderText(MainWindow.NAMES[self.language]["search"]+" "+self.fm.active.get_path())
         # Update path in terminal
         self.cmd_in.setPlaceholderText(self.fm.get_prefix())
-        # Add disks
-        self.disks.clear()
-        all_disks = [i.get_name() for i in self.fm.get_disks()]
-        self.disks.addItems(all_disks)
+        self.update_disks()
+        self.update_free_space()
+        # Add files
+        self.list_active()
+
+    def update_disks(self):
+        """
+        Refills disk selection only if the mounted disks changed since it was filled
+        """
+        if self.disks_version != itubackend.FileManager.disks.get_version() or self.disk_list is None:
+            self.disk_list = self.fm.get_disks()
+            self.disks_version = itubackend.FileManager.disks.get_version()
+            self.disks.clear()
+            self.disks.addItems([i.get_name() for i in self.disk_list])
+        all_disks = [i.get_name() for i in self.disk_list]
         if self.fm.disk.get_name() in all_disks:
             self.disks.setCurrentIndex(all_disks.index(self.fm.disk.get_name()))
-        else:
+        elif len(self.disk_list) > 0:  # Disk was unmounted
             self.switch_disk(0)
-        # Add files
-        self.displayed = self.fm.active.get_content()
-        self.displayed = self.filter_displayed(self.displayed)
-        if self.sort_by == FileExplorerWidget.SORT_NAME:
-            self.displayed.sort(key=lambda x: x.get_name().lower(), reverse=self.sort_desc)
-        elif self.sort_by == FileExplorerWidget.SORT_SIZE:
-            self.displayed.sort(key=lambda x: x.get_size() if x.is_file() else -1, reverse=self.sort_desc)
+
+    def list_active(self, keep_rows=False):
+        """
+        Starts listing of the active folder in background
+        :param keep_rows: If true, current rows are kept and only the differences are applied
+                          once the listing is done, otherwise rows are added as they are read
+                          and sorted once the listing is done
+        """
+        if self.worker is not None:
+            self.worker.cancel()
+        if self.listed_path is not None and self.listed_path != self.fm.active.get_path():
+            # Sizes of subfolders of the previous folder are not needed anymore
+            itubackend.FileManager.folder_sizes.cancel(self.listed_path)
+        self.listed_path = self.fm.active.get_path()
+        self.listing_generation += 1
+        self.listing_version = None
+        self.changes_pending = False
+        self.keep_rows = keep_rows
+        if keep_rows:
+            self.new_listing = {}
+        else:
+            self.listing = {}
+            self.sorted_listing = None
+            self.new_listing = self.listing
+            self.displayed = []
+            self.files.update(self.displayed)
+        self.worker = ListingWorker(self.fm.active, self.listing_generation)
+        self.worker.batch_ready.connect(self.listing_batch)
+        self.worker.listing_done.connect(self.listing_done)
+        self.worker.listing_failed.connect(self.listing_failed)
+        self.worker.start()
+
+    def listing_batch(self, generation, batch):
+        if generation != self.listing_generation:  # Stale listing
+            return
+        self.new_listing.update((i.get_name(), i) for i in batch)
+        if not self.keep_rows and not self.searching_disk():
+            self.sorted_listing = None
+            self.files.append(self.filter_displayed(batch))
+
+    def listing_done(self, generation, version):
+        if generation != self.listing_generation:
+            return
+        self.worker = None
+        self.listing_version = version
+        if self.keep_rows:
+            self.apply_updates(itubackend.diff_listing(self.listing, self.new_listing.values()))
+        else:
+            self.refresh_view()
+        self.new_listing = {}
+        if self.changes_pending:
+            self.refresh_changes()
+
+    def listing_failed(self, generation, msg):
+        if generation != self.listing_generation:
+            return
+        self.worker = None
+        self.parent.error.setText(MainWindow.NAMES[self.language]["e_other"])
+        self.parent.error.setInformativeText(msg)
+        self.parent.error.exec()
+
+    def refresh_changes(self):
+        """
+        Updates only rows of items which changed since the last listing
+        """
+        if self.worker is not None:  # Changes are fetched once the listing is done
+            self.changes_pending = True
+            return
+        changes = None
+        if self.listing_version is not None:
+            changes = itubackend.FileManager.cache.get_changes(self.fm.active.get_path(), self.listing_version)
+        if changes is None:  # Changes are not known, folder is listed again and compared
+            self.list_active(keep_rows=True)
+            return
+        self.listing_version, updates = changes
+        self.apply_updates(updates)
+
+    def apply_updates(self, updates):
+        """
+        Applies changes in the listing row by row, so selection and scroll position are kept
+        :param updates: dict name -> Item for added and changed items and name -> None for removed ones
+        """
+        self.sorted_listing = None
+        if len(updates) > FileExplorerWidget.MAX_ROW_UPDATES or self.searching_disk():
+            for name, i in updates.items():
+                if i is None:
+                    self.listing.pop(name, None)
+                else:
+                    self.listing[name] = i
+            self.refresh_view()
+            return
+
+        reg = self.search_regex()
+        model = self.files.model
+        for name, i in updates.items():
+            old = self.listing.pop(name, None)
+            row = self.find_row(old) if old is not None else None
+            if i is not None:
+                self.listing[name] = i
+            if i is None or (reg is not None and not reg.match(name)):
+                if row is not None:
+                    model.remove_item(row)
+                continue
+            if row is not None:
+                if self.find_position(i) in (row, row + 1):  # Stays at the same place
+                    model.replace_item(row, i)
+                    continue
+                model.remove_item(row)
+            model.insert_item(self.find_position(i), i)
+
+    def sort_key(self, item):
+        """
+        :return: Key by which items are sorted, the name is included so that keys are unique
+        """
+        name = item.get_name()
+        try:
+            if self.sort_by == FileExplorerWidget.SORT_SIZE:
+                if item.is_file():
+                    k = item.get_size()
+                else:
+                    # Only sizes of shown rows are computed (by the model), sorting uses those known
+                    size = itubackend.FileManager.folder_sizes.peek(item)
+                    k = size[0] if size is not None and size[0] is not None else -1
+            elif self.sort_by == FileExplorerWidget.SORT_CHANGED:
+                k = item.get_modification_time() if item.is_file() else -1
+            else:
+                k = 0
+        except OSError:  # File was removed or is a broken link
+            k = -1
+        return k, name.lower(), name
+
+    def find_position(self, item):
+        """
+        Binary search in displayed items
+        :return: Index at which the item belongs by the current sorting
+        """
+        key = self.sort_key(item)
+        lo, hi = 0, len(self.displayed)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self.sort_key(self.displayed[mid])
+            if (k > key) if self.sort_desc else (k < key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find_row(self, item):
+        """
+        :return: Index of the item in displayed items or None if it is not displayed
+        """
+        pos = self.find_position(item)
+        if pos < len(self.displayed) and self.displayed[pos] is item:
+            return pos
+        try:  # Item was renamed since it was sorted
+            return self.displayed.index(item)
+        except ValueError:
+            return None
+
+    def folder_size_ready(self, path):
+        """
+        Folder sizes are shown (or sorted by) in batches, not one by one
+        """
+        self.resort_timer.start()
+
+    def resort(self):
+        """
+        Shows computed folder sizes, displayed items are sorted again if they are sorted by size
+        """
+        if self.sort_by == FileExplorerWidget.SORT_SIZE:
+            self.sorted_listing = None
+            self.files.model.sort_items(self.sort_key, self.sort_desc)
         else:
-            self.displayed.sort(key=lambda x: x.get_modification_time() if x.is_file() else -1, reverse=self.sort_desc)
+            self.files.model.refresh_column(1)
+
+    def refresh_view(self):
+        """
+        Sorts and filters already listed items without reading the folder again
+        """
+        if self.searching_disk():
+            self.refresh_disk_search()
+            return
+        self.sorted_listing = sorted(self.listing.values(), key=self.sort_key, reverse=self.sort_desc)
+        self.displayed = self.filter_displayed(self.sorted_listing)
+        self.files.model.show_paths = False
         self.files.update(self.displayed)
 
-    def filter_displayed(self, disp):
-        search = self.search.text()
-        search = search.replace(".", "\\.")
+    def refresh_disk_search(self):
+        """
+        Displays items from the whole disk matching the search, they are taken from the disk's index
+        Index is queried in background, the search runs again once the index is built
+        """
+        self.search_generation += 1
+        worker = DiskSearchWorker(self.fm.disk.get_index(), self.filter_text, self.search_generation,
+                                  self.index_ready.emit)
+        worker.search_done.connect(self.disk_search_done)
+        worker.search_failed.connect(self.disk_search_failed)
+        worker.start()
+
+    def disk_search_done(self, generation, results, building):
+        if generation != self.search_generation or not self.searching_disk():
+            return
+        self.displayed = results
+        self.displayed.sort(key=self.sort_key, reverse=self.sort_desc)
+        self.files.model.show_paths = True
+        self.files.update(self.displayed)
+        self.set_search_state("search_disk_building" if building else None)
+
+    def disk_search_failed(self, generation, msg):
+        if generation != self.search_generation or not self.searching_disk():
+            return
+        self.displayed = []
+        self.files.model.show_paths = True
+        self.files.update(self.displayed)
+        self.set_search_state("search_disk_failed", msg)
+
+    def set_search_state(self, state, detail=""):
+        """
+        Shows state of the disk index next to the whole disk check box
+        :param state: Key of the state's name or None if the results are complete
+        """
+        text = MainWindow.NAMES[self.language]["search_disk"]
+        if state is not None:
+            text += " (" + MainWindow.NAMES[self.language][state] + ")"
+        self.search_disk.setText(text)
+        self.search_disk.setToolTip(detail)
+
+    def index_built(self, root):
+        if self.searching_disk() and root == self.fm.disk.get_path():
+            self.refresh_disk_search()
+
+    def searching_disk(self):
+        """
+        :return: If the displayed items are results of search on the whole disk
+        """
+        return self.filter_disk and len(self.filter_text) > 0
+
+    def apply_search(self):
+        """
+        Filters listed items by the search field
+        When the search text was only extended, already displayed items are filtered
+        further, otherwise all listed items are filtered, sorting is reused in both cases
+        """
+        text = self.search.text()
+        narrowing = text.startswith(self.filter_text) and FileExplorerWidget.compile_search(text) is not None and \
+            not any(c in FileExplorerWidget.SEARCH_SPECIAL for c in text[len(self.filter_text):]) and \
+            not self.searching_disk()
+        self.filter_text = text
+        self.filter_disk = self.search_disk.isChecked()
+        if self.searching_disk():
+            self.refresh_disk_search()
+            return
+        self.set_search_state(None)
+        if narrowing:
+            self.displayed = self.filter_displayed(self.displayed)
+        elif self.sorted_listing is not None:
+            self.displayed = self.filter_displayed(self.sorted_listing)
+        else:
+            self.refresh_view()
+            return
+        self.files.model.show_paths = False
+        self.files.update(self.displayed)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def compile_search(text):
+        """
+        :param text: Search text where * matches anything
+        :return: Compiled pattern or None if nothing is filtered out
+        """
+        if len(text) == 0:
+            return None
+        search = text.replace(".", "\\.")
         search = search.replace("*", ".*")
-        filt = []
         try:
-            reg = re.compile(search)
+            return re.compile(search)
         except Exception:
-            return disp
+            return None
 
-        for i in disp:
-            if reg.match(i.get_name()):
-                filt.append(i)
+    def search_regex(self):
+        """
+        :return: Compiled pattern of the applied search or None if nothing is filtered out
+        """
+        return FileExplorerWidget.compile_search(self.filter_text)
 
-        return filt
+    def filter_displayed(self, disp):
+        reg = self.search_regex()
+        if reg is None:
+            return list(disp)
+        match = reg.match
+        return [i for i in disp if match(i.get_name())]
 
     def cmd_in_entered(self):
+        if self.shell.running:  # Previous command has to end (or be interrupted) first, the text is kept
+            self.append_output("\n" + MainWindow.NAMES[self.language]["cmd_busy"] + "\n")
+            return
         formatted_out = "\n"+self.fm.get_prefix()+" "+self.cmd_in.text()+"\n"
-        self.cmd_out.setText(self.cmd_out.toPlainText()+formatted_out)
-        out, err = itubackend.make_shell_command(self.cmd_in.text(), self.fm.active.get_path())
-        if out is not None:
-            self.cmd_out.setText(self.cmd_out.toPlainText()+out)
-        if err is not None:
-            self.cmd_out.setText(self.cmd_out.toPlainText()+err)
-
-        self.cmd_out.moveCursor(QtGui.QTextCursor.End)
+        self.append_output(formatted_out)
+        self.shell.run(self.cmd_in.text(), self.fm.active.get_path())
         self.cmd_in.setText("")
 
+    def append_output(self, text):
+        self.cmd_out.append_text(text)
+
+    def command_done(self, code, directory):
+        if code != 0:
+            self.append_output("[{}]\n".format(code))
+        # Follow cd done in the persistent shell, otherwise the panel stays where the user navigated
+        if directory != "" and directory != self.fm.active.get_path() and os.path.isdir(directory):
+            self.fm.set_active(itubackend.Folder(directory))
+            self.update()
+
+    def update_free_space(self):
+        path = self.fm.disk.get_path()
+        usage = itubackend.FileManager.disk_usage.get(path)
+        if usage is not None:
+            self.free_space.setText(MainWindow.NAMES[self.language]["free_space"].format(
+                TransferPanel.format_size(usage.free), TransferPanel.format_size(usage.total)))
+        elif not itubackend.FileManager.disk_usage.is_available(path):
+            self.free_space.setText(MainWindow.NAMES[self.language]["disk_unavailable"])
+        else:
+            self.free_space.setText("")  # Not measured yet
+
     def switch_disk(self, i):
-        d = self.fm.get_disks()[i]
+        d = self.disk_list[i]
         if self.fm.disk.get_name() != d.get_name():
             self.fm.set_active(d.get_folder())
             self.fm.disk = d
             self.update()
 
 
+class TransferPanel(QFrame):
+    """
+    List of background copy and move jobs with their progress and controls
+    """
+
+    MAX_HEIGHT = 150
+    REFRESH_INTERVAL = 500  # ms
+    COLUMNS = 6
+
+    def __init__(self, window, language, parent):
+        super(TransferPanel, self).__init__(parent)
+        self.main_window = window
+        self.language = language
+        self.jobs = []
+        self.finished = set()
+        self.setMaximumHeight(TransferPanel.MAX_HEIGHT)
+
+        self.layout = QHBoxLayout(self)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+
+        self.table = QTableWidget(0, TransferPanel.COLUMNS, self)
+        self.table.setHorizontalHeaderLabels(MainWindow.NAMES[self.language]["transfers_header"])
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setStretchLastSection(True)
+
+        self.buttons = QFrame(self)
+        self.buttons_layout = QVBoxLayout(self.buttons)
+        self.buttons_layout.setContentsMargins(0, 0, 0, 0)
+        self.b_pause = QPushButton(MainWindow.NAMES[self.language]["t_pause"], self.buttons)
+        self.b_pause.pressed.connect(lambda: self.for_selected(lambda job: job.pause()))
+        self.b_resume = QPushButton(MainWindow.NAMES[self.language]["t_resume"], self.buttons)
+        self.b_resume.pressed.connect(lambda: self.for_selected(lambda job: job.resume()))
+        self.b_cancel = QPushButton(MainWindow.NAMES[self.language]["t_cancel"], self.buttons)
+        self.b_cancel.pressed.connect(lambda: self.for_selected(lambda job: job.cancel()))
+        self.b_limit = QPushButton(MainWindow.NAMES[self.language]["t_limit"], self.buttons)
+        self.b_limit.pressed.connect(self.limit_selected)
+        self.b_clear = QPushButton(MainWindow.NAMES[self.language]["t_clear"], self.buttons)
+        self.b_clear.pressed.connect(self.clear_finished)
+        for b in (self.b_pause, self.b_resume, self.b_cancel, self.b_limit, self.b_clear):
+            self.buttons_layout.addWidget(b)
+        self.buttons_layout.addStretch()
+
+        self.layout.addWidget(self.table)
+        self.layout.addWidget(self.buttons)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(TransferPanel.REFRESH_INTERVAL)
+        self.refresh()
+
+    @staticmethod
+    def format_size(size):
+        s, met = itubackend.auto_metric(size)
+        return str(round(s, 1)) + " " + met
+
+    @staticmethod
+    def format_time(seconds):
+        seconds = int(seconds)
+        if seconds >= 3600:
+            return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+        return "{}:{:02d}".format(seconds // 60, seconds % 60)
+
+    def for_selected(self, action):
+        for index in self.table.selectionModel().selectedRows():
+            if index.row() < len(self.jobs):
+                action(self.jobs[index.row()])
+        self.refresh()
+
+    def limit_selected(self):
+        rows = [index.row() for index in self.table.selectionModel().selectedRows() if index.row() < len(self.jobs)]
+        if len(rows) == 0:
+            return
+        jobs = [self.jobs[row] for row in rows]
+        rate, iops = jobs[0].get_limits()
+        mbs, ok = QInputDialog().getDouble(self, MainWindow.NAMES[self.language]["t_limit"],
+                                           MainWindow.NAMES[self.language]["t_limit_d"],
+                                           rate / 2 ** 20, 0, 1e6, 1)
+        if not ok:
+            return
+        iops, ok = QInputDialog().getInt(self, MainWindow.NAMES[self.language]["t_limit"],
+                                         MainWindow.NAMES[self.language]["t_limit_iops_d"],
+                                         int(iops), 0, 10 ** 7)
+        if ok:
+            for job in jobs:
+                job.set_limits(int(mbs * 2 ** 20), iops)
+
+    def clear_finished(self):
+        itubackend.FileManager.transfers.clear_finished()
+        self.table.clearSelection()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Shows the current state of all jobs, panels are refreshed once some job finishes
+        """
+        self.jobs = itubackend.FileManager.transfers.get_jobs()
+        self.table.setRowCount(len(self.jobs))
+        names = MainWindow.NAMES[self.language]
+        for row, job in enumerate(self.jobs):
+            progress = job.get_progress()
+            if job.delete:  # Progress is in items
+                done = "{} / {} {}".format(job.done, job.total, names["items"]) if job.total is not None else ""
+            elif job.total is not None:
+                done = "{} / {}".format(TransferPanel.format_size(job.done), TransferPanel.format_size(job.total))
+            else:
+                done = ""
+            if progress is not None:
+                done = "{} % {}".format(int(progress * 100), done)
+            speed = job.get_speed()
+            eta = job.get_eta()
+            if not speed:
+                speed_text = ""
+            elif job.delete:
+                speed_text = "{} {}/s".format(int(speed), names["items"])
+            else:
+                speed_text = TransferPanel.format_size(speed) + "/s"
+            texts = [job.item.get_name(),
+                     done,
+                     speed_text,
+                     TransferPanel.format_time(eta) if eta is not None else "",
+                     names["t_states"][job.get_state()],
+                     ", ".join(job.get_methods())]
+            tooltips = [job.item.get_path() if job.delete else
+                        ("{} -> {}" if job.move else "{} => {}").format(job.item.get_path(), job.to),
+                        "", "", "", job.error or "", ""]
+            for col in range(TransferPanel.COLUMNS):
+                cell = self.table.item(row, col)
+                if cell is None:
+                    cell = QTableWidgetItem()
+                    self.table.setItem(row, col, cell)
+                cell.setText(texts[col])
+                cell.setToolTip(tooltips[col])
+        self.setVisible(len(self.jobs) > 0)
+        finished = set(id(job) for job in self.jobs if job.is_finished())
+        if finished - self.finished:
+            self.main_window.check_folders()
+        self.finished = finished
+
+
 class MainWindow(QMainWindow):
 
     NAMES = {
@@ -311,14 +1213,23 @@ class MainWindow(QMainWindow):
             "title": "ITU Prohlížeč souborů",
             "files_header": ["Název", "Velikost", "Datum úpravy"],
             "search": "Hledat v",
+            "search_disk": "Celý disk",
+            "search_disk_building": "indexuje se",
+            "search_disk_failed": "chyba",
+            "free_space": "{} volných z {}",
+            "cmd_busy": "Předchozí příkaz stále běží (Ctrl+C ho přeruší)",
+            "disk_unavailable": "Disk nedostupný",
+            "items": "položek",
             "new_folder": "Nová složka",
             "new_file": "Nový soubor",
-            "action_filter": "Podmíněné vykonání (např. sh test $! == OK)",
+            "action_filter": "Podmíněné vykonání (např. size > 10MB and name ~ *.log nebo sh test $! == OK)",
+            "verify": "Ověřit kopie",
+            "verify_mo": "Zkontrolovat zkopírovaná data proti zdroji",
             "b_mkdir_mo": "Vytvořit novou složku",
             "b_mkdir_d": "Jméno složky",
             "b_touch_mo": "Vytvořit prázný soubor",
             "b_touch_d": "Jméno souboru",
-            "b_delete_mo": "Smazat",
+            "b_delete_mo": "Přesunout do koše (se Shiftem smazat trvale)",
             "b_rename_mo": "Přejmenovat",
             "b_rename_d": "Nové jméno pro ",
             "b_move_right_mo": "Přesunout do složky napravo",
@@ -329,6 +1240,7 @@ class MainWindow(QMainWindow):
             "b_delete_file_confirm": "Opravdu chcete smazat soubor: ",
             "b_delete_folder_confirm": "Opravdu chcete smazat složku a všechen její obsah: ",
             "b_delete_multiple_confirm": "Opravdu chcete smazat všechny tyto položky: ",
+            "b_delete_no_trash_confirm": "Tyto položky nelze přesunout do koše, chcete je smazat trvale: ",
             "mb_settings": "Nastavení",
             "mb_set_windows": "Pracovní okna",
             "mb_set_windows_add": "Přidat okno",
@@ -353,27 +1265,54 @@ class MainWindow(QMainWindow):
             "e_file_exists": "Soubor s tímto jménem již existuje",
             "e_folder_exists": "Složka s tímto jménem již existuje",
             "e_action_filter": "Nesprávný syntax podmíněného vykonání",
-            "e_action_filter_det": "Povolené operátory jsou == a != a musí být odděleny mezerami",
+            "e_action_filter_det": "Podmínky pole operátor hodnota (name, ext, path, size, mtime, type) lze spojit and, or, not a závorkami, "
+                                   "příkaz shellu musí být porovnán operátorem == nebo != odděleným mezerami",
+            "e_restore": "Položku nelze obnovit z koše",
             "e_other": "Při operaci nastala chyba",
             "error": "Chyba",
             "close": "Zavřít",
             "yes": "Ano",
             "no": "Ne",
             "warning": "Pozor",
+            "transfers_header": ["Název", "Průběh", "Rychlost", "Zbývá", "Stav", "Metoda"],
+            "t_pause": "Pozastavit",
+            "t_resume": "Pokračovat",
+            "t_cancel": "Zrušit",
+            "t_limit": "Omezit rychlost",
+            "t_limit_d": "Maximální rychlost v MB/s (0 bez omezení)",
+            "t_limit_iops_d": "Maximum operací za sekundu, u mazání položek (0 bez omezení)",
+            "t_clear": "Odstranit dokončené",
+            "t_states": {
+                itubackend.TransferJob.QUEUED: "Ve frontě",
+                itubackend.TransferJob.RUNNING: "Probíhá",
+                itubackend.TransferJob.PAUSED: "Pozastaveno",
+                itubackend.TransferJob.DONE: "Hotovo",
+                itubackend.TransferJob.FAILED: "Chyba",
+                itubackend.TransferJob.CANCELLED: "Zrušeno",
+            },
         },
         "en": {
             "language_name": "English",
             "title": "ITU File explorer",
             "files_header": ["Name", "Size", "Last modification"],
             "search": "Search in",
+            "search_disk": "Whole disk",
+            "search_disk_building": "indexing",
+            "search_disk_failed": "failed",
+            "free_space": "{} free of {}",
+            "cmd_busy": "Previous command is still running (Ctrl+C interrupts it)",
+            "disk_unavailable": "Disk unavailable",
+            "items": "items",
             "new_folder": "New folder",
             "new_file": "New file",
-            "action_filter": "Action filter (eg. sh test $! == OK)",
+            "action_filter": "Action filter (eg. size > 10MB and name ~ *.log or sh test $! == OK)",
+            "verify": "Verify copies",
+            "verify_mo": "Check copied data against the source",
             "b_mkdir_mo": "Create new folder",
             "b_mkdir_d": "Folder name",
             "b_touch_mo": "Create empty file",
             "b_touch_d": "File name",
-            "b_delete_mo": "Delete",
+            "b_delete_mo": "Move to trash (delete permanently with Shift)",
             "b_rename_mo": "Rename",
             "b_rename_d": "New name for ",
             "b_move_right_mo": "Move to the folder on the right",
@@ -384,6 +1323,7 @@ class MainWindow(QMainWindow):
             "b_delete_file_confirm": "Do you really want to delete file: ",
             "b_delete_folder_confirm": "Do you really want to delete folder and all it's contents: ",
             "b_delete_multiple_confirm": "Do you really want to delete all these items: ",
+            "b_delete_no_trash_confirm": "These items cannot be moved to trash, do you want to delete them permanently: ",
             "mb_settings": "Settings",
             "mb_set_windows": "Working windows",
             "mb_set_windows_add": "Add window",
@@ -408,27 +1348,54 @@ class MainWindow(QMainWindow):
             "e_file_exists": "File with this name already exists",
             "e_folder_exists": "Folder with this name already exists",
             "e_action_filter": "Incorrect syntax of action filter",
-            "e_action_filter_det": "Allowed operators are == and != and they have to be separated by spaces",
+            "e_action_filter_det": "Conditions field operator value (name, ext, path, size, mtime, type) can be combined with and, or, "
+                                   "not and parentheses, shell command has to be compared by == or != separated by spaces",
+            "e_restore": "Item could not be restored from trash",
             "e_other": "An error arised during an operation",
             "error": "Error",
             "close": "Close",
             "yes": "Yes",
             "no": "No",
             "warning": "Warning",
+            "transfers_header": ["Name", "Progress", "Speed", "Remaining", "State", "Method"],
+            "t_pause": "Pause",
+            "t_resume": "Resume",
+            "t_cancel": "Cancel",
+            "t_limit": "Limit speed",
+            "t_limit_d": "Maximum speed in MB/s (0 for no limit)",
+            "t_limit_iops_d": "Maximum operations per second, items when deleting (0 for no limit)",
+            "t_clear": "Clear finished",
+            "t_states": {
+                itubackend.TransferJob.QUEUED: "Queued",
+                itubackend.TransferJob.RUNNING: "Running",
+                itubackend.TransferJob.PAUSED: "Paused",
+                itubackend.TransferJob.DONE: "Done",
+                itubackend.TransferJob.FAILED: "Failed",
+                itubackend.TransferJob.CANCELLED: "Cancelled",
+            },
         },
         "fr": {
             "language_name": "Français",
             "title": "Explorateur de Fichiers",
             "files_header": ["Nom", "Taille", "Dernière modification"],
             "search": "Search in",
+            "search_disk": "Disque entier",
+            "search_disk_building": "indexation",
+            "search_disk_failed": "échec",
+            "free_space": "{} libres sur {}",
+            "cmd_busy": "La commande précédente est toujours en cours (Ctrl+C l'interrompt)",
+            "disk_unavailable": "Disque indisponible",
+            "items": "éléments",
             "new_folder": "Nouveau dossier",
             "new_file": "Nouveau fichier",
-            "action_filter": "Filtre d'action (p. ex. sh test $! == OK)",
+            "action_filter": "Filtre d'action (p. ex. size > 10MB and name ~ *.log ou sh test $! == OK)",
+            "verify": "Vérifier les copies",
+            "verify_mo": "Vérifier les données copiées par rapport à la source",
             "b_mkdir_mo": "Créer nouveau dossier",
             "b_mkdir_d": "Nom de dossier",
             "b_touch_mo": "Créer un fichier vide",
             "b_touch_d": "Nom de fichier",
-            "b_delete_mo": "Supprimer",
+            "b_delete_mo": "Mettre à la corbeille (supprimer définitivement avec Maj)",
             "b_rename_mo": "Renommer",
             "b_rename_d": "Nouveau nom pour ",
             "b_move_right_mo": "Déplacer vers dossier de droite",
@@ -439,6 +1406,7 @@ class MainWindow(QMainWindow):
             "b_delete_file_confirm": "Voulez-vous vraiment supprimer le fichier : ",
             "b_delete_folder_confirm": "Voulez-vous vraiment supprimer le dossier : ",
             "b_delete_multiple_confirm": "Voulez-vous vraiment supprimer le dossier et tout le contenu : ",
+            "b_delete_no_trash_confirm": "Ces éléments ne peuvent pas être mis à la corbeille, voulez-vous les supprimer définitivement : ",
             "mb_settings": "Paramètres",
             "mb_set_windows": "Fenêtres de travail",
             "mb_set_windows_add": "Ajouter une fenêtre",
@@ -463,13 +1431,31 @@ class MainWindow(QMainWindow):
             "e_file_exists": "Le fichier avec ce nom existe déjà",
             "e_folder_exists": "Le dossier avec ce nom existe déjà",
             "e_action_filter": "Syntaxe incorrecte de filtre d'action",
-            "e_action_filter_det": "Les opérateurs autorisés sont == et != avec des espaces",
+            "e_action_filter_det": "Les conditions champ opérateur valeur (name, ext, path, size, mtime, type) se combinent avec and, or, "
+                                   "not et parenthèses, une commande shell se compare par == ou != avec des espaces",
+            "e_restore": "L'élément n'a pas pu être restauré",
             "e_other": "Une erreur est survenue lors d'une opération",
             "error": "Erreur",
             "close": "Fermer",
             "yes": "Oui",
             "no": "Non",
             "warning": "Attention",
+            "transfers_header": ["Nom", "Progression", "Vitesse", "Restant", "État", "Méthode"],
+            "t_pause": "Pause",
+            "t_resume": "Reprendre",
+            "t_cancel": "Annuler",
+            "t_limit": "Limiter la vitesse",
+            "t_limit_d": "Vitesse maximale en Mo/s (0 sans limite)",
+            "t_limit_iops_d": "Opérations maximales par seconde, éléments lors de la suppression (0 sans limite)",
+            "t_clear": "Effacer les terminés",
+            "t_states": {
+                itubackend.TransferJob.QUEUED: "En attente",
+                itubackend.TransferJob.RUNNING: "En cours",
+                itubackend.TransferJob.PAUSED: "En pause",
+                itubackend.TransferJob.DONE: "Terminé",
+                itubackend.TransferJob.FAILED: "Échec",
+                itubackend.TransferJob.CANCELLED: "Annulé",
+            },
         }
     }
 
@@ -480,6 +1466,9 @@ class MainWindow(QMainWindow):
     STARTING_PATH = "/"
     DEFAULT_PATH = STARTING_PATH
     CONFIG_PATH = "./.itu_conf.json"
+    PERSISTENT_SHELL = False  # One shell per panel keeping cd and variables between commands
+    CONSOLE_SCROLLBACK = 10000  # Lines kept in command output of each panel
+    FOLDER_POLL_INTERVAL = 1000  # ms
 
     def __init__(self, width, height, language="cz"):
         super(MainWindow, self).__init__()
@@ -531,6 +1520,20 @@ class MainWindow(QMainWindow):
                 MainWindow.DEFAULT_PATH = self.conf["default_path"]
             if "explorer_amount" in self.conf:
                 MainWindow.EXPLORER_AMOUNT = self.conf["explorer_amount"]
+            if "large_file_threshold" in self.conf:
+                itubackend.LARGE_FILE_THRESHOLD = self.conf["large_file_threshold"]
+            if "large_file_workers" in self.conf:
+                itubackend.LARGE_FILE_WORKERS = self.conf["large_file_workers"]
+            if "idle_priority" in self.conf:
+                itubackend.IDLE_PRIORITY = self.conf["idle_priority"]
+            if "console_scrollback" in self.conf:
+                MainWindow.CONSOLE_SCROLLBACK = self.conf["console_scrollback"]
+            if "persistent_shell" in self.conf:
+                MainWindow.PERSISTENT_SHELL = self.conf["persistent_shell"]
+            if "transfer_rate_limit" in self.conf:
+                itubackend.FileManager.transfers.rate_limit = self.conf["transfer_rate_limit"]
+            if "transfer_iops_limit" in self.conf:
+                itubackend.FileManager.transfers.iops_limit = self.conf["transfer_iops_limit"]
             if "font" in self.conf:
                 if "family" in self.conf["font"]:
                     fnt = QFont(self.conf["font"]["family"])
@@ -547,12 +1550,38 @@ class MainWindow(QMainWindow):
         self.fms = [itubackend.FileManager(MainWindow.DEFAULT_PATH) for _ in range(MainWindow.EXPLORER_AMOUNT)]
 
         self.action_filter = None
+        self.verify = None
+
+        # Refresh panels when a shown folder changes on disk
+        self.folder_timer = QtCore.QTimer(self)
+        self.folder_timer.timeout.connect(self.check_folders)
+        self.folder_timer.start(MainWindow.FOLDER_POLL_INTERVAL)
+        if itubackend.FileManager.cache.fileno() is not None:
+            self.folder_notifier = QtCore.QSocketNotifier(itubackend.FileManager.cache.fileno(),
+                                                          QtCore.QSocketNotifier.Read, self)
+            self.folder_notifier.activated.connect(self.check_folders)
+        # Refresh disk selections on mount and unmount
+        self.disk_notifier = None
+        if itubackend.FileManager.disks.fileno() is not None:
+            self.disk_notifier = QtCore.QSocketNotifier(itubackend.FileManager.disks.fileno(),
+                                                        QtCore.QSocketNotifier.Exception, self)
+            self.disk_notifier.activated.connect(self.check_disks)
+        else:
+            self.folder_timer.timeout.connect(self.check_disks)
 
         # Center the screen
         screen = QApplication.desktop().screenNumber(QApplication.desktop().cursor().pos())
         center = QApplication.desktop().screenGeometry(screen).center()
         self.move(center.x() - self.width() / 2, center.y() - self.height() / 2)
 
+        # Continue copying and moving interrupted by closing the app
+        itubackend.FileManager.transfers.resume_interrupted()
+        # Remove old items from trash in background
+        itubackend.FileManager.trash.purge()
+        self.last_trashed = []
+        self.undo_shortcut = QShortcut(QtGui.QKeySequence.Undo, self)
+        self.undo_shortcut.activated.connect(self.undo_rm)
+
         self.alt_pressed = False
         self.initUI()
         self.settings_window = SettingsWindow(self)
@@ -677,6 +1706,11 @@ class MainWindow(QMainWindow):
         self.action_filter.setPlaceholderText(MainWindow.NAMES[self.language]["action_filter"])
         self.action_filter.setMinimumWidth(300)
 
+        if self.verify is None:
+            self.verify = QCheckBox(self.top_frame)
+        self.verify.setText(MainWindow.NAMES[self.language]["verify"])
+        self.verify.setToolTip(MainWindow.NAMES[self.language]["verify_mo"])
+
         self.top_button_frame = QFrame(self.top_frame)
         self.top_button_frame_layout = QHBoxLayout(self.top_button_frame)
         self.top_button_frame_layout.setContentsMargins(0, 0, 0, 0)
@@ -692,6 +1726,7 @@ class MainWindow(QMainWindow):
         self.top_button_frame_layout.addWidget(self.b_move_right)
 
         self.top_frame_layout.addWidget(self.top_button_frame, alignment=QtCore.Qt.AlignLeft | QtCore.Qt.AlignTop)
+        self.top_frame_layout.addWidget(self.verify, alignment=QtCore.Qt.AlignRight | QtCore.Qt.AlignTop)
         self.top_frame_layout.addWidget(self.action_filter, alignment=QtCore.Qt.AlignRight | QtCore.Qt.AlignTop)
 
         # Creating explorer windows
@@ -713,6 +1748,9 @@ class MainWindow(QMainWindow):
         self.layout.addWidget(self.top_frame)
         # Add splitter under
         self.layout.addWidget(self.splitter)
+        # Background copying and moving
+        self.transfers = TransferPanel(self, self.language, self.main_widget)
+        self.layout.addWidget(self.transfers)
 
         self.update_explorer_focus()
 
@@ -776,6 +1814,23 @@ class MainWindow(QMainWindow):
         else:
             self.b_move_right.setEnabled(True)
 
+    def check_folders(self):
+        changed = itubackend.FileManager.cache.poll()
+        for path in changed:
+            itubackend.FilenameIndex.folder_changed(path)
+            itubackend.FileManager.folder_sizes.invalidate(path)
+        for i in self.explorers:
+            if i.fm.active.get_path() in changed:
+                i.refresh_changes()
+
+    def check_disks(self):
+        if self.disk_notifier is not None:
+            itubackend.FileManager.disks.refresh()
+        else:
+            itubackend.FileManager.disks.get_disks()  # Enumerated again once the cached list is old
+        for i in self.explorers:
+            i.update_disks()
+
     def add_explorer(self):
         if MainWindow.EXPLORER_AMOUNT < MainWindow.MAX_EXPLORER_AMOUNT:
             MainWindow.EXPLORER_AMOUNT += 1
@@ -819,7 +1874,7 @@ class MainWindow(QMainWindow):
                     self.error.setText(MainWindow.NAMES[self.language]["e_other"])
                     self.error.setInformativeText("")
                     self.error.exec()
-                self.initUI()
+                self.check_folders()
 
     def touch(self):
         if MainWindow.ACTIVE_EXPLORER is not None:
@@ -837,23 +1892,31 @@ class MainWindow(QMainWindow):
                     self.error.setText(MainWindow.NAMES[self.language]["e_other"])
                     self.error.setInformativeText("")
                     self.error.exec()
-                self.initUI()
+                self.check_folders()
+
+    def filter_selected(self, selected):
+        """
+        Evaluates action filter for all selected items at once
+        :param selected: Selected items
+        :return: Items passing the action filter or None if the filter is incorrect (error is shown)
+        """
+        af_cond = self.action_filter.text()
+        if len(af_cond) == 0:
+            return selected
+        try:
+            return itubackend.FileManager.action_filter.filter(af_cond, MainWindow.ACTIVE_EXPLORER.fm.active.get_path(),
+                                                               selected)
+        except itubackend.IncorrectActionFilterException:
+            self.error.setText(MainWindow.NAMES[self.language]["e_action_filter"])
+            self.error.setInformativeText(MainWindow.NAMES[self.language]["e_action_filter_det"])
+            self.error.exec()
+            return None
 
     def rm(self):
         if MainWindow.ACTIVE_EXPLORER is not None:
-            selected = MainWindow.ACTIVE_EXPLORER.files.get_selected()
-            af_cond = self.action_filter.text()
-            if len(af_cond) > 0:
-                for i, e in enumerate(selected):
-                    try:
-                        if not itubackend.check_action_filter(af_cond, MainWindow.ACTIVE_EXPLORER.fm.active.get_path(),
-                                                              e.get_name()):
-                            del selected[i]
-                    except itubackend.IncorrectActionFilterException:
-                        self.error.setText(MainWindow.NAMES[self.language]["e_action_filter"])
-                        self.error.setInformativeText(MainWindow.NAMES[self.language]["e_action_filter_det"])
-                        self.error.exec()
-                        return
+            selected = self.filter_selected(MainWindow.ACTIVE_EXPLORER.files.get_selected())
+            if selected is None or len(selected) == 0:
+                return
 
             if len(selected) > 1:
                 match = [a.get_name() for a in selected]
@@ -866,35 +1929,52 @@ class MainWindow(QMainWindow):
                 self.confirm.setText(MainWindow.NAMES[self.language]["b_delete_folder_confirm"])
                 self.confirm.setInformativeText(selected[0].get_name())
 
+            # Shift deletes permanently, otherwise items go to trash and can be restored with undo
+            permanent = QApplication.keyboardModifiers() & Qt.ShiftModifier
             ok = self.confirm.exec()
             if ok == QMessageBox.Yes:
-                try:
+                self.last_trashed = []
+                remove = selected if permanent else []
+                if not permanent:
                     for i in selected:
-                        i.remove()
-                except FileExistsError:
-                    self.error.setText(MainWindow.NAMES[self.language]["e_file_exists"])
-                    self.error.exec()
-                except Exception:
-                    self.error.setText(MainWindow.NAMES[self.language]["e_other"])
-                    self.error.exec()
-                self.initUI()
+                        try:
+                            self.last_trashed.append(i.trash())
+                        except OSError:  # E.g. no writable trash on this device
+                            remove.append(i)
+                    # Items which could not be trashed are deleted only if the user agrees once more
+                    if len(remove) > 0:
+                        self.confirm.setText(MainWindow.NAMES[self.language]["b_delete_no_trash_confirm"])
+                        self.confirm.setInformativeText(", ".join(i.get_name() for i in remove))
+                        if self.confirm.exec() != QMessageBox.Yes:
+                            remove = []
+                for i in remove:
+                    itubackend.FileManager.transfers.add_removal(type(i)(i.get_path()))
+                self.transfers.refresh()
+                self.check_folders()
+
+    def undo_rm(self):
+        """
+        Restores items trashed by the last removal
+        """
+        failed = []
+        for i in self.last_trashed:
+            try:
+                itubackend.FileManager.trash.restore(i)
+            except OSError:
+                failed.append(i.path)
+        self.last_trashed = []
+        self.check_folders()
+        if len(failed) > 0:
+            self.error.setText(MainWindow.NAMES[self.language]["e_restore"])
+            self.error.setInformativeText(", ".join(failed))
+            self.error.exec()
 
     def rename(self):
         if MainWindow.ACTIVE_EXPLORER is not None:
-            selected = MainWindow.ACTIVE_EXPLORER.files.get_selected()
-            af_cond = self.action_filter.text()
+            selected = self.filter_selected(MainWindow.ACTIVE_EXPLORER.files.get_selected())
+            if selected is None:
+                return
             for i in selected:
-                if len(af_cond) > 0:
-                    try:
-                        if not itubackend.check_action_filter(af_cond, MainWindow.ACTIVE_EXPLORER.fm.active.get_path(),
-                                                              i.get_name()):
-                            continue
-                    except itubackend.IncorrectActionFilterException:
-                        self.error.setText(MainWindow.NAMES[self.language]["e_action_filter"])
-                        self.error.setInformativeText(MainWindow.NAMES[self.language]["e_action_filter_det"])
-                        self.error.exec()
-                        return
-
                 name, ok = QInputDialog().getText(self, MainWindow.NAMES[self.language]["b_rename_mo"],
                                                   MainWindow.NAMES[self.language]["b_rename_d"] + i.get_name(), QLineEdit.Normal,
                                                   i.get_name())
@@ -905,68 +1985,37 @@ class MainWindow(QMainWindow):
                         self.error.setText(MainWindow.NAMES[self.language]["e_other"])
                         self.error.setInformativeText("")
                         self.error.exec()
-                    self.initUI()
                 else:
                     break
-        self.initUI()
+        self.check_folders()
 
     def copy_to(self, left=True, to_fm=None):
         if to_fm is None:
             win_to = self.explorers[self.explorers.index(MainWindow.ACTIVE_EXPLORER) + (-1 if left else 1)]
         if MainWindow.ACTIVE_EXPLORER is not None:
-            selected = MainWindow.ACTIVE_EXPLORER.files.get_selected()
-            af_cond = self.action_filter.text()
+            selected = self.filter_selected(MainWindow.ACTIVE_EXPLORER.files.get_selected())
+            if selected is None:
+                return
             for i in selected:
-                if len(af_cond) > 0:
-                    try:
-                        if not itubackend.check_action_filter(af_cond, MainWindow.ACTIVE_EXPLORER.fm.active.get_path(),
-                                                              i.get_name()):
-                            continue
-                    except itubackend.IncorrectActionFilterException:
-                        self.error.setText(MainWindow.NAMES[self.language]["e_action_filter"])
-                        self.error.setInformativeText(MainWindow.NAMES[self.language]["e_action_filter_det"])
-                        self.error.exec()
-                        return
-                try:
-                    if to_fm is None:
-                        i.copy(win_to.fm.active, True)
-                    else:
-                        i.copy(to_fm.active, True)
-                except Exception:
-                    self.error.setText(MainWindow.NAMES[self.language]["e_other"])
-                    self.error.setInformativeText("")
-                    self.error.exec()
-                self.initUI()
-        self.initUI()
+                # Fresh item, the listed one stays untouched by the background job
+                itubackend.FileManager.transfers.add(type(i)(i.get_path()),
+                                                     win_to.fm.active if to_fm is None else to_fm.active,
+                                                     move=False, verify=self.verify.isChecked())
+        self.transfers.refresh()
 
     def move_to(self, left=True, to_fm=None):
         if to_fm is None:
             win_to = self.explorers[self.explorers.index(MainWindow.ACTIVE_EXPLORER) + (-1 if left else 1)]
         if MainWindow.ACTIVE_EXPLORER is not None:
-            selected = MainWindow.ACTIVE_EXPLORER.files.get_selected()
-            af_cond = self.action_filter.text()
+            selected = self.filter_selected(MainWindow.ACTIVE_EXPLORER.files.get_selected())
+            if selected is None:
+                return
             for i in selected:
-                if len(af_cond) > 0:
-                    try:
-                        if not itubackend.check_action_filter(af_cond, MainWindow.ACTIVE_EXPLORER.fm.active.get_path(),
-                                                              i.get_name()):
-                            continue
-                    except itubackend.IncorrectActionFilterException:
-                        self.error.setText(MainWindow.NAMES[self.language]["e_action_filter"])
-                        self.error.setInformativeText(MainWindow.NAMES[self.language]["e_action_filter_det"])
-                        self.error.exec()
-                        return
-                try:
-                    if to_fm is None:
-                        i.move(win_to.fm.active, True)
-                    else:
-                        i.move(to_fm.active, True)
-                except Exception:
-                    self.error.setText(MainWindow.NAMES[self.language]["e_other"])
-                    self.error.setInformativeText("")
-                    self.error.exec()
-                self.initUI()
-        self.initUI()
+                # Fresh item, the listed one stays untouched by the background job
+                itubackend.FileManager.transfers.add(type(i)(i.get_path()),
+                                                     win_to.fm.active if to_fm is None else to_fm.active,
+                                                     move=True, verify=self.verify.isChecked())
+        self.transfers.refresh()
 
 
 class SettingsWindow(QMainWindow):
@@ -1128,6 +2177,13 @@ class SettingsWindow(QMainWindow):
             "big_icons": self.parent.bigger_icons,
             "default_path": MainWindow.DEFAULT_PATH,
             "explorer_amount": MainWindow.EXPLORER_AMOUNT,
+            "large_file_threshold": itubackend.LARGE_FILE_THRESHOLD,
+            "large_file_workers": itubackend.LARGE_FILE_WORKERS,
+            "idle_priority": itubackend.IDLE_PRIORITY,
+            "persistent_shell": MainWindow.PERSISTENT_SHELL,
+            "console_scrollback": MainWindow.CONSOLE_SCROLLBACK,
+            "transfer_rate_limit": itubackend.FileManager.transfers.rate_limit,
+            "transfer_iops_limit": itubackend.FileManager.transfers.iops_limit,
             "font": {
                 "family": self.font().family(),
                 "bold": self.font().bold(),
@@ -1206,4 +2262,6 @@ if __name__ == "__main__":
 
     win = MainWindow(1024, 600)
 
-    sys.exit(app.exec_())
+    ret = app.exec_()
+    itubackend.FileManager.transfers.flush_journals()
+    sys.exit(ret)